@@ -0,0 +1,146 @@
+"""
+Streaming aggregation of raw transaction CSVs into data/daily.csv.
+
+retail.ipynb reads all of retail_sales_dataset.csv and groups it in memory.
+Here every file is read in chunks of CHUNK_ROWS transactions, each chunk is
+reduced to partial aggregates per (Date, Product Category) - sums of
+Quantity, Total Amount and Price per Unit plus a row count for the price
+mean - and partials are added together. Memory is bounded by the number of
+distinct category-days, not transactions. Files are aggregated in parallel,
+one worker process per file:
+
+    python aggregate.py logs/*.csv                          # append new days to data/daily.csv
+    python aggregate.py --rebuild retail_sales_dataset.csv  # rewrite data/daily.csv
+    python aggregate.py --date-format %d/%m/%Y export.csv   # dates other than YYYY-MM-DD[ hh:mm:ss]
+
+Dates are parsed with one explicit format (DATE_FORMAT, ISO 8601, unless
+--date-format says otherwise). Left to infer it, pandas would guess from
+each chunk's first date, and a day like 03/04 could be read as March in one
+chunk and April in the next.
+
+Appending takes the same lock as /api/ingest, and running workers pick the
+new rows up on their next request. Category-days on or before a category's
+last day in daily.csv are skipped. --rebuild replaces daily.csv with the
+gap-filled aggregate of the given files and rewrites the history store;
+running workers need a restart to see it.
+"""
+import argparse
+import fcntl
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from feature_builder import daily_grid
+from history_store import DAILY_PATH, HISTORY_STORE_PATH, read_history_csv, save_history_store
+
+# transactions read per chunk
+CHUNK_ROWS = 100_000
+# format of the Date column, as pd.to_datetime takes it
+DATE_FORMAT = "ISO8601"
+
+KEYS = ["Date", "Product Category"]
+COLUMNS = KEYS + ["Quantity", "Price per Unit", "Total Amount"]
+
+
+def aggregate_chunk(chunk, date_format=DATE_FORMAT):
+    """Partial aggregates of a frame of transactions, indexed by (Date, Product Category)."""
+    chunk = chunk.assign(Date=pd.to_datetime(chunk["Date"], format=date_format).dt.normalize())
+    grouped = chunk.groupby(KEYS)
+    return pd.DataFrame({
+        "Quantity": grouped["Quantity"].sum(),
+        "Total Amount": grouped["Total Amount"].sum(),
+        "price_sum": grouped["Price per Unit"].sum(),
+        "rows": grouped.size(),
+    })
+
+
+def combine(partials):
+    """Add partial aggregates together."""
+    total = None
+    for partial in partials:
+        total = partial if total is None else total.add(partial, fill_value=0)
+    return total
+
+
+def aggregate_file(path, chunk_rows=CHUNK_ROWS, date_format=DATE_FORMAT):
+    """Partial aggregates of one transaction CSV, read chunk_rows rows at a time."""
+    chunks = pd.read_csv(path, usecols=COLUMNS, chunksize=chunk_rows)
+    return combine(aggregate_chunk(chunk, date_format) for chunk in chunks)
+
+
+def aggregate_files(paths, workers=None, chunk_rows=CHUNK_ROWS, date_format=DATE_FORMAT):
+    """
+    Daily rows (Date, Product Category, Quantity, Price per Unit, Total Amount)
+    for all transactions in paths, sorted by category then Date like the
+    notebook's groupby. Price per Unit is the mean over transactions.
+    workers: processes to aggregate files in (default: one per CPU, at most one per file)
+    date_format: format of the Date column (see DATE_FORMAT)
+    """
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            partials = list(pool.map(aggregate_file, paths, [chunk_rows] * len(paths),
+                                     [date_format] * len(paths)))
+    else:
+        partials = [aggregate_file(path, chunk_rows, date_format) for path in paths]
+    total = combine(p for p in partials if p is not None)
+    daily = total.reset_index()
+    daily["Price per Unit"] = daily["price_sum"] / daily["rows"]
+    return daily[COLUMNS].sort_values(["Product Category", "Date"], kind="stable").reset_index(drop=True)
+
+
+def append_daily(daily, csv_path=DAILY_PATH):
+    """
+    Append category-days after each category's last day in csv_path.
+    Returns (appended, skipped) row counts.
+    """
+    with open(csv_path, "r+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        existing = read_history_csv(csv_path)
+        last = daily["Product Category"].map(existing.last_actual_dates)
+        new = daily[last.isna() | (daily["Date"] > last)]
+        unknown = set(new["Product Category"]) - set(existing.last_actual_dates)
+        if unknown:
+            raise ValueError(f"Categories not in {csv_path}: {', '.join(sorted(unknown))}; use --rebuild")
+        out = new.assign(Date=new["Date"].dt.strftime("%Y-%m-%d"))[existing.columns]
+        f.seek(0, os.SEEK_END)
+        f.write(out.to_csv(header=False, index=False, lineterminator="\n").encode())
+    return len(new), len(daily) - len(new)
+
+
+def rebuild_daily(daily, csv_path=DAILY_PATH, store_path=HISTORY_STORE_PATH):
+    """Replace csv_path with the gap-filled daily rows and, if store_path is given, rewrite the history store."""
+    grid = daily_grid(daily)
+    grid["Date"] = grid["Date"].dt.strftime("%Y-%m-%d")
+    grid.to_csv(csv_path + ".tmp", index=False, lineterminator="\n")
+    os.replace(csv_path + ".tmp", csv_path)
+    if store_path is not None:
+        save_history_store(store_path, read_history_csv(csv_path), csv_path)
+    return len(grid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="raw transaction CSVs")
+    parser.add_argument("--daily", default=DAILY_PATH, help="daily aggregate to merge into")
+    parser.add_argument("--rebuild", action="store_true", help="replace the daily aggregate instead of appending")
+    parser.add_argument("--workers", type=int, default=None, help="parallel processes (default: CPU count)")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--date-format", default=DATE_FORMAT,
+                        help="format of the Date column, e.g. %%d/%%m/%%Y (default: ISO 8601)")
+    args = parser.parse_args()
+
+    daily = aggregate_files(args.files, args.workers, args.chunk_rows, args.date_format)
+    print(f"Aggregated {len(args.files)} file(s) into {len(daily)} category-days")
+    if args.rebuild:
+        # the history store only mirrors the app's daily.csv
+        store_path = HISTORY_STORE_PATH if os.path.abspath(args.daily) == os.path.abspath(DAILY_PATH) else None
+        n = rebuild_daily(daily, args.daily, store_path)
+        print(f"Wrote {n} rows to {args.daily}" + (f" and rebuilt {store_path}" if store_path else ""))
+    else:
+        appended, skipped = append_daily(daily, args.daily)
+        print(f"Appended {appended} rows to {args.daily}, skipped {skipped} already covered")
+
+if __name__ == "__main__":
+    main()
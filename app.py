@@ -1,26 +1,708 @@
-from flask import Flask, request, jsonify, render_template, url_for, send_from_directory
-import joblib
+from flask import Flask, Response, g, request, jsonify, render_template, url_for, send_from_directory
 import pandas as pd
 from flask_cors import CORS
 import numpy as np
-from feature_builder import build_features
+from feature_builder import HISTORY_DAYS, build_feature_tensor, build_features_range
+from forest import FOREST_PATH, load_forest
+from category_models import CATEGORY_MODELS_PATH, MANIFEST, CategoryForests, RunRemovedError
+from history_store import HISTORY_STORE_PATH, load_history_store, read_history_csv
+from forecast_cache import ForecastCache, SharedForecastStore, TieredForecastCache
+from microbatch import MicroBatcher
+from registry import ModelRegistry
+from recursive import recursive_forecast
+from simulate import N_PATHS, QUANTILES, cumulative_quantiles, simulate_demand
+from materialize import FORECASTS_PATH, data_fingerprint, load_forecasts, materialize_forecasts
 import os
+import io
+from collections import namedtuple
+from functools import partial
+import csv
+import fcntl
+import hmac
+import json
+import threading
 
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
 
-# load model and features
-model = joblib.load("./models/rf_demand_forecast.pkl")
-with open("./models/features.txt") as f:
-    FEATURES = f.read().splitlines()
+MODEL_PATH = "./models/rf_demand_forecast.pkl"
+FEATURES_PATH = "./models/features.txt"
+DAILY_PATH = "./data/daily.csv"
 
-daily = pd.read_csv("./data/daily.csv", parse_dates=["Date"])
+# "materialized" answers /predict from a precomputed forecast table,
+# "live" runs the model on every request
+FORECAST_MODE = os.environ.get("FORECAST_MODE", "materialized")
+
+# Micro-batching of live predictions across concurrent requests (threaded
+# workers): a batch stays open this many ms or until it holds this many rows.
+# 0 disables it.
+MICROBATCH_WINDOW_MS = float(os.environ.get("MICROBATCH_WINDOW_MS", "0"))
+MICROBATCH_MAX_ROWS = int(os.environ.get("MICROBATCH_MAX_ROWS", "256"))
+
+# Days past the end of the history /predict accepts. They are forecast
+# recursively, feeding each day's prediction back into the next day's
+# features. 0 keeps requests within the history.
+FORECAST_HORIZON_DAYS = int(os.environ.get("FORECAST_HORIZON_DAYS", "0"))
+
+# LRU cache of live per-day forecasts; 0 disables it
+FORECAST_CACHE_SIZE = int(os.environ.get("FORECAST_CACHE_SIZE", "100000"))
+# SQLite file shared by all workers on the host, behind the LRU; empty disables it
+FORECAST_CACHE_DB = os.environ.get("FORECAST_CACHE_DB", "")
+
+# Bearer token for POST /api/ingest; empty disables the endpoint
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN", "")
+# Ingested rows may be dated at most this many days after MAX_DATE (and never
+# after today): every day up to the newest row joins the history grid for good
+INGEST_MAX_GAP_DAYS = int(os.environ.get("INGEST_MAX_GAP_DAYS", "7"))
+
+# Hot reload: the model, features.txt and the forest export are checked for
+# changes at most every MODEL_POLL_SECONDS (0 disables watching), and
+# POST /api/admin/reload with this bearer token reloads on demand
+MODEL_POLL_SECONDS = float(os.environ.get("MODEL_POLL_SECONDS", "2"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# "global" serves the single forest in models/; "per_category" serves the
+# forests `train.py --per-category` writes to models/categories, each loaded
+# on first use and dropped again, least recently used first, once the loaded
+# ones take more than CATEGORY_MODEL_BUDGET_MB
+MODEL_LAYOUT = os.environ.get("MODEL_LAYOUT", "global")
+CATEGORY_MODELS_DIR = os.environ.get("CATEGORY_MODELS_PATH", CATEGORY_MODELS_PATH)
+CATEGORY_MODEL_BUDGET_MB = float(os.environ.get("CATEGORY_MODEL_BUDGET_MB", "256"))
+# Threads /predict/simulate spreads categories over; 0 means one per CPU
+SIMULATION_THREADS = int(os.environ.get("SIMULATION_THREADS", "0"))
+
+# days at the end of the history every new model must predict before it is served
+SMOKE_DAYS = 28
+
+# Per-category columnar history (gap-filled, one row per day), so feature
+# windows are found without filtering a frame. Memory-mapped from the binary
+# store in data/history when it matches daily.csv, else parsed from the CSV.
+# (device, inode) of daily.csv, taken before it is read: a rewritten file
+# (aggregate.py --rebuild, train.py --raw) gets a new one, and rows past
+# DAILY_CSV_OFFSET of that file are not appends to this history
+_stat = os.stat(DAILY_PATH)
+DAILY_CSV_ID = (_stat.st_dev, _stat.st_ino)
+_loaded = load_history_store(HISTORY_STORE_PATH, DAILY_PATH) or read_history_csv(DAILY_PATH)
+HISTORY = _loaded.history
+DAILY_COLUMNS = _loaded.columns
+# bytes of daily.csv applied so far; rows appended past it (by /api/ingest in
+# any worker, or after the store was built) are picked up by sync_history
+DAILY_CSV_OFFSET = _loaded.csv_offset
+# last day with an actual row per category; later days are gap-filled
+LAST_ACTUAL_DATES = _loaded.last_actual_dates
+del _loaded, _stat
 
 # Cache date range for validation
-MIN_DATE = daily["Date"].min()
-MAX_DATE = daily["Date"].max()
-VALID_CATEGORIES = daily["Product Category"].unique().tolist()
+EPOCH = pd.Timestamp("1970-01-01")
+MIN_DATE = EPOCH + pd.Timedelta(days=int(min(hist.days[0] for hist in HISTORY.categories.values())))
+MAX_DATE = EPOCH + pd.Timedelta(days=int(max(hist.days[-1] for hist in HISTORY.categories.values())))
+VALID_CATEGORIES = list(HISTORY.categories)
+CATEGORY_CODES = {cat: i for i, cat in enumerate(VALID_CATEGORIES)}
+# one row per category, in code order (the recursive forecast's layout)
+ALL_CODES = np.arange(len(VALID_CATEGORIES))
+
+# Feature rows for days after MAX_DATE come from the recursive forecast and
+# are appended to the tensor, so everything below serves them like any other day
+MAX_FORECAST_DATE = MAX_DATE + pd.Timedelta(days=FORECAST_HORIZON_DAYS)
+
+# Date labels for every day offset, so responses don't format dates per request
+DATE_LABELS = [d.strftime("%Y-%m-%d") for d in pd.date_range(MIN_DATE, MAX_FORECAST_DATE, freq="D")]
+
+# Serializes history updates and model swaps within a worker; daily.csv
+# itself is flock'ed so workers append and read it one at a time
+HISTORY_LOCK = threading.Lock()
+
+# Everything that depends on the model, built together and swapped as one
+# reference (REGISTRY.current), so a request never mixes two versions:
+# feature_tensor[c, d] is the row (in features order) for category code c on
+# MIN_DATE + d days; forecast_table holds the materialized forecasts for it
+ServedModel = namedtuple("ServedModel", [
+    "version", "forest", "features", "feature_tensor", "forecast_table", "fingerprint", "microbatcher",
+])
+
+def predict_direct(forest, X, codes=None):
+    """
+    Run a forest on feature rows in its feature order and undo the log1p target.
+    codes: category code of each row, which per-category models route on
+    """
+    if isinstance(forest, CategoryForests):
+        pred_log = forest.predict(X, codes)
+    else:
+        pred_log = forest.predict(X)
+    return np.expm1(pred_log)
+
+def predict_intervals(forest, X, codes, levels):
+    """
+    predict_direct plus quantiles of the trees' predicted quantities at
+    levels, from the same traversal: array (n_rows, 1 + len(levels)) with
+    the prediction in column 0.
+    """
+    if isinstance(forest, CategoryForests):
+        pred_log, quantiles = forest.predict_quantiles(X, codes, levels, np.expm1)
+    else:
+        pred_log, quantiles = forest.predict_quantiles(X, levels, np.expm1)
+    return np.column_stack([np.expm1(pred_log), quantiles])
+
+def load_model():
+    """
+    Read the model and feature list. The model is served as a compiled forest,
+    read from the models/forest export when present so workers never import sklearn.
+    """
+    if MODEL_LAYOUT == "per_category":
+        forests = CategoryForests(CATEGORY_MODELS_DIR, VALID_CATEGORIES, CATEGORY_MODEL_BUDGET_MB * 2 ** 20)
+        return forests, forests.feature_names
+    forest = load_forest(MODEL_PATH, os.environ.get("FOREST_PATH", FOREST_PATH))
+    with open(FEATURES_PATH) as f:
+        features = f.read().splitlines()
+    # the forest indexes columns by position, so features.txt must list them in
+    # the order the model was fit on
+    if forest.feature_names is not None and forest.feature_names != features:
+        raise ValueError(f"{FEATURES_PATH} does not match the model's feature order")
+    return forest, features
+
+def smoke_test(predict_fn, feature_tensor):
+    """Predict the last SMOKE_DAYS days of every category; raise ValueError on unusable output."""
+    days = feature_tensor[:, -SMOKE_DAYS:]
+    X = days.reshape(-1, feature_tensor.shape[2])
+    preds = np.asarray(predict_fn(X, codes=np.repeat(np.arange(days.shape[0]), days.shape[1])))
+    if preds.shape != (len(X),):
+        raise ValueError(f"Smoke batch: expected {len(X)} predictions, got shape {preds.shape}")
+    if not np.all(np.isfinite(preds)) or np.any(preds < 0):
+        raise ValueError("Smoke batch: predictions must be finite, non-negative quantities")
+
+def forecast_horizon(predict_fn, features):
+    """Feature rows (n_categories, FORECAST_HORIZON_DAYS, n_features) of the recursive forecast past MAX_DATE."""
+    if MODEL_LAYOUT != "per_category":
+        return recursive_forecast(HISTORY, VALID_CATEGORIES, FORECAST_HORIZON_DAYS,
+                                  partial(predict_fn, codes=ALL_CODES), features)[1]
+    # one category at a time, so each model is loaded once however small the budget
+    return np.concatenate([
+        recursive_forecast(HISTORY, [product], FORECAST_HORIZON_DAYS,
+                           partial(predict_fn, codes=ALL_CODES[code:code + 1]), features)[1]
+        for code, product in enumerate(VALID_CATEGORIES)
+    ])
+
+def prepare_model(loaded):
+    """
+    ServedModel for a loaded (forest, features): the feature tensor over the
+    current history, checked on the smoke batch, then the recursive horizon
+    and the forecast table. Called with HISTORY_LOCK held.
+    """
+    forest, features = loaded
+    version = forest.source_sha256
+    predict_fn = partial(predict_direct, forest)
+    tensor = build_feature_tensor(HISTORY, VALID_CATEGORIES, MIN_DATE, MAX_DATE, features)
+    smoke_test(predict_fn, tensor)
+    if FORECAST_HORIZON_DAYS > 0:
+        tensor = np.concatenate([tensor, forecast_horizon(predict_fn, features)], axis=1)
+
+    # Materialized forecasts: (category code, day offset) -> predicted quantity
+    fingerprint = data_fingerprint(version, FEATURES_PATH, DAILY_PATH)
+    table = None
+    if FORECAST_MODE == "materialized":
+        table = load_forecasts(FORECASTS_PATH, VALID_CATEGORIES, MIN_DATE, tensor.shape[1], fingerprint)
+        if table is None:
+            codes = np.repeat(ALL_CODES, tensor.shape[1])
+            table = materialize_forecasts(partial(predict_fn, codes=codes), tensor)
+
+    microbatcher = None
+    if MICROBATCH_WINDOW_MS > 0:
+        microbatcher = MicroBatcher(predict_fn, MICROBATCH_WINDOW_MS, MICROBATCH_MAX_ROWS)
+    return ServedModel(version, forest, features, tensor, table, fingerprint, microbatcher)
+
+def on_model_swap(old, new):
+    """
+    Once the new version is live, stop the replaced one's micro-batching
+    thread and drop its cached forecasts.
+    """
+    if old.microbatcher is not None:
+        old.microbatcher.close()
+    if FORECAST_CACHE is None or old.version == new.version:
+        return
+    if isinstance(FORECAST_CACHE, TieredForecastCache):
+        FORECAST_CACHE.model_version = new.version
+    FORECAST_CACHE.invalidate(model_version=old.version)
+
+if MODEL_LAYOUT == "per_category":
+    MODEL_WATCH_PATHS = [os.path.join(CATEGORY_MODELS_DIR, MANIFEST)]
+else:
+    MODEL_WATCH_PATHS = [MODEL_PATH, FEATURES_PATH,
+                         os.path.join(os.environ.get("FOREST_PATH", FOREST_PATH), "meta.json")]
+
+REGISTRY = ModelRegistry(
+    load_model, prepare_model,
+    watch_paths=MODEL_WATCH_PATHS,
+    lock=HISTORY_LOCK, on_swap=on_model_swap, poll_seconds=MODEL_POLL_SECONDS,
+)
+
+def predict_quantities(served, X, codes):
+    """
+    Predicted quantities for feature rows of the given category codes,
+    micro-batched with concurrent requests if enabled.
+    """
+    if served.microbatcher is not None:
+        return served.microbatcher.predict(X, codes)
+    return predict_direct(served.forest, X, codes)
+
+# Per-day forecasts computed live, keyed by (model version, category, date).
+# The shared file is tied to the model and data it was filled from: opened
+# over another daily.csv (rebuilt or edited between restarts) it starts empty
+FORECAST_CACHE = ForecastCache(FORECAST_CACHE_SIZE) if FORECAST_CACHE_SIZE > 0 else None
+if FORECAST_CACHE is not None and FORECAST_CACHE_DB:
+    FORECAST_CACHE = TieredForecastCache(
+        FORECAST_CACHE, SharedForecastStore(FORECAST_CACHE_DB, fingerprint=REGISTRY.current.fingerprint),
+        REGISTRY.current.version)
+
+# Upper bound on items accepted by /predict/batch
+MAX_BATCH_ITEMS = 10000
+
+# Upper bound on quantile levels in a request's "intervals"
+MAX_INTERVALS = 9
+
+# Upper bounds on a /predict/simulate request
+MAX_SIMULATION_PATHS = 10000
+MAX_SIMULATION_DAYS = 365
+
+# Streamed responses predict and send this many category-days at a time
+STREAM_CHUNK_ROWS = 1024
+STREAM_MIMETYPES = ("application/x-ndjson", "text/csv")
+
+def validate_query(data, start_date=None):
+    """
+    Validate one {product_category, date, n_days} query.
+    start_date: the query's date if the caller already parsed it
+    Returns (product, start_date, n_days); raises ValueError with the error message for the client
+    """
+    product = data.get("product_category")
+    date = data.get("date")
+    n_days = data.get("n_days")
+
+    if not product:
+        raise ValueError("Missing product_category")
+    if not date:
+        raise ValueError("Missing date")
+    try:
+        n_days = int(n_days) if n_days is not None else 1
+    except (TypeError, ValueError):
+        raise ValueError("n_days must be an integer")
+    if n_days <= 0 or n_days > 365:
+        raise ValueError("n_days must be between 1 and 365")
+
+    if product not in VALID_CATEGORIES:
+        raise ValueError(f"Invalid category '{product}'. Valid: {', '.join(VALID_CATEGORIES)}")
+
+    if start_date is None or pd.isna(start_date):
+        try:
+            start_date = pd.to_datetime(date)
+        except Exception as e:
+            raise ValueError(f"Invalid date format: {str(e)}")
+
+    end_date = start_date + pd.Timedelta(days=n_days - 1)
+    if not (MIN_DATE <= start_date <= MAX_FORECAST_DATE) or not (MIN_DATE <= end_date <= MAX_FORECAST_DATE):
+        raise ValueError(
+            f"Date range out of valid bounds. Valid: {MIN_DATE.strftime('%Y-%m-%d')} to {MAX_FORECAST_DATE.strftime('%Y-%m-%d')}"
+        )
+    return product, start_date, n_days
+
+def parse_intervals(data):
+    """
+    Quantile levels of a request's optional "intervals" ([0.1, 0.5, 0.9]), or None.
+    Raises ValueError with the error message for the client.
+    """
+    levels = data.get("intervals")
+    if levels is None:
+        return None
+    error = f"intervals must be a list of 1 to {MAX_INTERVALS} quantile levels between 0 and 1"
+    if not isinstance(levels, list) or not 0 < len(levels) <= MAX_INTERVALS:
+        raise ValueError(error)
+    if not all(isinstance(level, (int, float)) and not isinstance(level, bool) and 0 <= level <= 1
+               for level in levels):
+        raise ValueError(error)
+    return [float(level) for level in levels]
+
+def validate_simulation(data):
+    """
+    Validate a /predict/simulate body.
+    Returns (categories, n_days, n_paths, seed); raises ValueError with the error message for the client
+    """
+    products = data.get("product_category", VALID_CATEGORIES)
+    if isinstance(products, str):
+        products = [products]
+    if not isinstance(products, list) or not products:
+        raise ValueError("product_category must be a category or a non-empty list of them")
+    invalid = [p for p in products if p not in VALID_CATEGORIES]
+    if invalid:
+        raise ValueError(f"Invalid category '{invalid[0]}'. Valid: {', '.join(VALID_CATEGORIES)}")
+
+    bounds = {"n_days": (30, MAX_SIMULATION_DAYS), "n_paths": (N_PATHS, MAX_SIMULATION_PATHS)}
+    values = {}
+    for name, (default, upper) in bounds.items():
+        value = data.get(name)
+        try:
+            values[name] = int(value) if value is not None else default
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an integer")
+        if not 1 <= values[name] <= upper:
+            raise ValueError(f"{name} must be between 1 and {upper}")
+
+    seed = data.get("seed")
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+        raise ValueError("seed must be a non-negative integer")
+    return list(dict.fromkeys(products)), values["n_days"], values["n_paths"], seed
+
+def quantile_labels(levels):
+    return [f"{level:g}" for level in levels]
+
+def forecast_days(served, codes, offsets, levels=None):
+    """
+    Predicted quantities for parallel arrays of category codes and day offsets.
+    Days the forecast table covers are read from it, then the forecast cache
+    is tried, and the rest go through a single model.predict on their stacked
+    feature rows (and are cached).
+    served: the ServedModel answering the request
+    levels: quantile levels to add over the trees' predictions; the result is
+            then (n, 1 + len(levels)) as predict_intervals returns it
+    """
+    if levels:
+        # the table, the cache and the micro-batcher only keep the mean
+        return predict_intervals(served.forest, served.feature_tensor[codes, offsets], codes, levels)
+    preds = np.full(len(codes), np.nan)
+    table = served.forecast_table
+    if table is not None:
+        covered = offsets < table.shape[1]
+        preds[covered] = table[codes[covered], offsets[covered]]
+    missing = np.flatnonzero(np.isnan(preds))
+    if len(missing) == 0:
+        return preds
+
+    keys = None
+    if FORECAST_CACHE is not None:
+        keys = [(served.version, VALID_CATEGORIES[c], DATE_LABELS[o])
+                for c, o in zip(codes[missing].tolist(), offsets[missing].tolist())]
+        preds[missing] = FORECAST_CACHE.get_many(keys)
+        uncached = np.isnan(preds[missing])
+        keys = [key for key, miss in zip(keys, uncached) if miss]
+        missing = missing[uncached]
+    if len(missing):
+        preds[missing] = predict_quantities(served, served.feature_tensor[codes[missing], offsets[missing]],
+                                            codes[missing])
+        if keys is not None:
+            FORECAST_CACHE.put_many(keys, preds[missing])
+    return preds
+
+def forecast_queries(served, queries, levels=None):
+    """
+    Forecast every day of every (product, start_date, n_days) query in one
+    pass, one array per query (with levels, one row per day as forecast_days).
+    """
+    if not queries:
+        return []
+    n_days = np.array([n for _, _, n in queries])
+    codes = np.repeat([CATEGORY_CODES[product] for product, _, _ in queries], n_days)
+    starts = np.repeat([(start_date - MIN_DATE).days for _, start_date, _ in queries], n_days)
+    # day index within each query: 0..n-1
+    within = np.arange(n_days.sum()) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+    preds = forecast_days(served, codes, starts + within, levels)
+    return np.split(preds, np.cumsum(n_days)[:-1])
+
+def forecast_response(served, product, start_date, n_days, pred_qtys, levels=None):
+    offset = (start_date - MIN_DATE).days
+    dates = DATE_LABELS[offset:offset + n_days]
+    if levels:
+        labels = quantile_labels(levels)
+        predictions = [
+            {"date": dt, "predicted_quantity": round(row[0], 2),
+             "quantiles": {label: round(q, 2) for label, q in zip(labels, row[1:])}}
+            for dt, row in zip(dates, pred_qtys.tolist())
+        ]
+    else:
+        predictions = [
+            {"date": dt, "predicted_quantity": round(q, 2)}
+            for dt, q in zip(dates, pred_qtys.tolist())
+        ]
+    return {
+        "model_version": served.version,
+        "product_category": product,
+        "start_date": start_date.strftime("%Y-%m-%d"),
+        "n_days": n_days,
+        "predictions": predictions,
+    }
+
+def stream_mimetype():
+    """Streaming format picked by the Accept header, or None for a plain JSON response."""
+    best = request.accept_mimetypes.best_match(("application/json",) + STREAM_MIMETYPES)
+    return best if best in STREAM_MIMETYPES else None
+
+def _stream_chunks(entries):
+    """Group (item, query) entries into chunks of about STREAM_CHUNK_ROWS category-days."""
+    chunk, rows = [], 0
+    for item, query in entries:
+        chunk.append((item, query))
+        rows += query[2] if isinstance(query, tuple) else 1
+        if rows >= STREAM_CHUNK_ROWS:
+            yield chunk
+            chunk, rows = [], 0
+    if chunk:
+        yield chunk
+
+def stream_forecasts(served, entries, mimetype, fields, levels=None):
+    """
+    Generator of NDJSON lines or CSV rows, one per category-day.
+    served: the ServedModel answering the request
+    entries: (item index, query) pairs, query being a validated
+             (product, start_date, n_days) tuple or an error message
+    fields: output columns; "item" and "error" are only written if listed
+    levels: quantile levels, written as q<level> columns after predicted_quantity
+    Each chunk is predicted and sent before the next one is started, so
+    memory stays bounded however many days are requested.
+    """
+    def encode(rows):
+        if mimetype == "text/csv":
+            buf = io.StringIO()
+            csv.DictWriter(buf, fields, extrasaction="ignore").writerows(rows)
+            return buf.getvalue()
+        return "".join(json.dumps({k: row[k] for k in fields if k in row}) + "\n" for row in rows)
+
+    labels = [f"q{label}" for label in quantile_labels(levels)] if levels else []
+    if labels:
+        at = fields.index("predicted_quantity") + 1
+        fields = fields[:at] + labels + fields[at:]
+    if mimetype == "text/csv":
+        yield ",".join(fields) + "\r\n"
+    for chunk in _stream_chunks(entries):
+        try:
+            preds = iter(forecast_queries(served, [q for _, q in chunk if isinstance(q, tuple)], levels))
+        except Exception as e:
+            if isinstance(e, RunRemovedError):
+                # the response has started; reload so the next request gets the current run
+                REGISTRY.reload(force=False)
+            yield encode([{"error": f"Prediction failed: {str(e)}"}])
+            return
+        rows = []
+        for item, query in chunk:
+            if not isinstance(query, tuple):
+                rows.append({"item": item, "error": query})
+                continue
+            product, start_date, n_days = query
+            offset = (start_date - MIN_DATE).days
+            for dt, q in zip(DATE_LABELS[offset:offset + n_days], next(preds).tolist()):
+                row = {"item": item, "product_category": product, "date": dt}
+                if labels:
+                    row["predicted_quantity"] = round(q[0], 2)
+                    row.update(zip(labels, (round(v, 2) for v in q[1:])))
+                else:
+                    row["predicted_quantity"] = round(q, 2)
+                rows.append(row)
+        yield encode(rows)
+
+def parse_actuals(data):
+    """
+    Validate the rows of an ingest request: {"rows": [{date, product_category,
+    quantity, price}, ...]} or a bare list.
+    Returns [(product, date, quantity, price)] sorted by date; raises ValueError
+    with the error message for the client
+    """
+    items = data.get("rows") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError("Expected a non-empty list of rows")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise ValueError(f"At most {MAX_BATCH_ITEMS} rows per request")
+
+    today = pd.Timestamp.today().normalize()
+    rows, seen = [], set()
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Row {i}: must be a JSON object")
+        product = item.get("product_category")
+        if product not in VALID_CATEGORIES:
+            raise ValueError(f"Row {i}: invalid category '{product}'. Valid: {', '.join(VALID_CATEGORIES)}")
+        if not item.get("date"):
+            raise ValueError(f"Row {i}: missing date")
+        try:
+            date = pd.to_datetime(item["date"]).normalize()
+        except Exception as e:
+            raise ValueError(f"Row {i}: invalid date format: {str(e)}")
+        if date.tz is not None:
+            raise ValueError(f"Row {i}: date must not include a time zone")
+        if date > today:
+            raise ValueError(f"Row {i}: date {date.strftime('%Y-%m-%d')} is in the future")
+        try:
+            quantity = float(item.get("quantity"))
+            price = float(item.get("price"))
+        except (TypeError, ValueError):
+            raise ValueError(f"Row {i}: quantity and price must be numbers")
+        if not (np.isfinite(quantity) and quantity >= 0 and np.isfinite(price) and price > 0):
+            raise ValueError(f"Row {i}: quantity must be >= 0 and price > 0")
+        if (product, date) in seen:
+            raise ValueError(f"Row {i}: duplicate row for {product} on {date.strftime('%Y-%m-%d')}")
+        seen.add((product, date))
+        rows.append((product, date, quantity, price))
+    return sorted(rows, key=lambda row: row[1])
+
+def apply_actuals(rows):
+    """
+    Fold (product, date, quantity, price) actuals, sorted by date, into the
+    in-memory history and everything derived from it. Only feature rows whose
+    HISTORY_DAYS window holds a changed day, plus the recursive horizon, are
+    rebuilt, re-predicted and dropped from the forecast cache.
+    The caller holds HISTORY_LOCK.
+    Returns the number of cache entries invalidated.
+    """
+    global MAX_DATE, MAX_FORECAST_DATE, DATE_LABELS
+    served = REGISTRY.current
+    predict_fn = partial(predict_direct, served.forest)
+    old_max = MAX_DATE
+    new_max = max(old_max, rows[-1][1])
+    by_product = {}
+    for product, date, quantity, price in rows:
+        by_product.setdefault(product, []).append((date, quantity, price))
+
+    # changed days per category: its actuals, and every new day once the grid grows
+    changed = {}
+    for product in VALID_CATEGORIES:
+        actuals = by_product.get(product, [])
+        if not actuals and new_max == old_max:
+            continue
+        dates, quantities, prices = zip(*actuals) if actuals else ((), (), ())
+        HISTORY.record(product, list(dates), quantities, prices, last_date=new_max)
+        if actuals:
+            LAST_ACTUAL_DATES[product] = dates[-1]
+        first = min(dates + ((old_max + pd.Timedelta(days=1),) if new_max > old_max else ()))
+        last = new_max if new_max > old_max else dates[-1]
+        changed[product] = (first, min(last + pd.Timedelta(days=HISTORY_DAYS), new_max))
+
+    n_old = (old_max - MIN_DATE).days + 1
+    n_hist = (new_max - MIN_DATE).days + 1
+    tensor = np.empty((len(VALID_CATEGORIES), n_hist, len(served.features)))
+    tensor[:, :n_old] = served.feature_tensor[:, :n_old]
+    stale = np.zeros((len(VALID_CATEGORIES), n_hist + FORECAST_HORIZON_DAYS), dtype=bool)
+    stale[:, n_hist:] = True
+    for product, (first, end) in changed.items():
+        code, start, n = CATEGORY_CODES[product], (first - MIN_DATE).days, (end - first).days + 1
+        tensor[code, start:start + n] = build_features_range(HISTORY, product, first, n, served.features).to_numpy(dtype=float)
+        stale[code, start:start + n] = True
+    if FORECAST_HORIZON_DAYS > 0:
+        tensor = np.concatenate([tensor, forecast_horizon(predict_fn, served.features)], axis=1)
+
+    table = None
+    if served.forecast_table is not None:
+        table = np.empty(stale.shape)
+        table[:, :n_old] = served.forecast_table[:, :n_old]
+        table[stale] = predict_fn(tensor[stale], codes=np.nonzero(stale)[0])
+
+    max_forecast = new_max + pd.Timedelta(days=FORECAST_HORIZON_DAYS)
+    labels = DATE_LABELS[:n_old] + [
+        d.strftime("%Y-%m-%d") for d in pd.date_range(old_max + pd.Timedelta(days=1), max_forecast, freq="D")
+    ]
+    # grow the arrays before the bounds, so validated offsets always index them
+    REGISTRY.current = served._replace(feature_tensor=tensor, forecast_table=table)
+    DATE_LABELS = labels
+    MAX_DATE, MAX_FORECAST_DATE = new_max, max_forecast
+
+    dropped = 0
+    if FORECAST_CACHE is not None:
+        for product, (first, end) in changed.items():
+            # recursive forecasts depend on every day before them
+            last = max_forecast if FORECAST_HORIZON_DAYS > 0 else end
+            dropped += FORECAST_CACHE.invalidate(model_version=served.version, category=product,
+                                                 first_date=first.strftime("%Y-%m-%d"),
+                                                 last_date=last.strftime("%Y-%m-%d"))
+    return dropped
+
+# set once daily.csv no longer is the file this worker loaded; syncing and
+# ingest stop until a restart, instead of parsing the new file from a stale offset
+DAILY_CSV_REPLACED = None
+
+def _daily_csv_unchanged(stat):
+    """Whether stat (of daily.csv) is the file this worker loaded, only ever appended to; records it if not."""
+    global DAILY_CSV_REPLACED
+    if DAILY_CSV_REPLACED is None and ((stat.st_dev, stat.st_ino) != DAILY_CSV_ID or stat.st_size < DAILY_CSV_OFFSET):
+        DAILY_CSV_REPLACED = (f"{DAILY_PATH} was replaced or truncated after this worker loaded it; "
+                              "its rows are not applied until the workers restart")
+        app.logger.error(DAILY_CSV_REPLACED)
+    return DAILY_CSV_REPLACED is None
+
+def _read_appended(f):
+    """Rows appended to daily.csv past DAILY_CSV_OFFSET, as apply_actuals input. f is locked by the caller."""
+    global DAILY_CSV_OFFSET
+    f.seek(DAILY_CSV_OFFSET)
+    chunk = f.read()
+    # whole lines only
+    end = chunk.rfind(b"\n") + 1
+    DAILY_CSV_OFFSET += end
+    if end == 0:
+        return []
+    new = pd.read_csv(io.BytesIO(chunk[:end]), names=DAILY_COLUMNS, header=None, parse_dates=["Date"])
+    new = new[new["Product Category"].isin(VALID_CATEGORIES)].sort_values("Date", kind="stable")
+    return list(zip(new["Product Category"], new["Date"],
+                    new["Quantity"].astype(float), new["Price per Unit"].astype(float)))
+
+def _append_csv(f, rows):
+    """Append actuals to daily.csv (f is open for binary read/write and locked)."""
+    global DAILY_CSV_OFFSET
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, DAILY_COLUMNS, lineterminator="\n")
+    for product, date, quantity, price in rows:
+        writer.writerow({"Date": date.strftime("%Y-%m-%d"), "Product Category": product,
+                         "Quantity": quantity, "Price per Unit": price, "Total Amount": quantity * price})
+    f.seek(0, os.SEEK_END)
+    f.write(buf.getvalue().encode())
+    f.flush()
+    DAILY_CSV_OFFSET = f.tell()
+
+def sync_history():
+    """Apply rows other workers appended to daily.csv since this one last looked."""
+    if DAILY_CSV_REPLACED is not None:
+        return
+    stat = os.stat(DAILY_PATH)
+    if not _daily_csv_unchanged(stat) or stat.st_size <= DAILY_CSV_OFFSET:
+        return
+    with HISTORY_LOCK, open(DAILY_PATH, "rb") as f:
+        fcntl.flock(f, fcntl.LOCK_SH)
+        # it may have been replaced between the stat and the open
+        if not _daily_csv_unchanged(os.fstat(f.fileno())):
+            return
+        rows = _read_appended(f)
+        if rows:
+            apply_actuals(rows)
+
+# rows appended since the history store was built
+sync_history()
+
+def served_model():
+    """The ServedModel answering this request, taken once so a reload mid-request can't switch it."""
+    if "served" not in g:
+        g.served = REGISTRY.current
+    return g.served
+
+def bearer_ok(token):
+    """Whether the request carries Authorization: Bearer <token>."""
+    auth = request.headers.get("Authorization", "").encode()
+    return hmac.compare_digest(auth, f"Bearer {token}".encode())
+
+@app.before_request
+def pick_up_changes():
+    sync_history()
+    if MODEL_POLL_SECONDS > 0:
+        REGISTRY.poll()
+
+@app.errorhandler(RunRemovedError)
+def run_removed(e):
+    """
+    The per-category run this worker serves was removed by a later training:
+    reload now (waiting for a reload the watcher already started), so the
+    client's retry is answered by the current manifest.
+    """
+    REGISTRY.reload(force=False)
+    response = jsonify({"error": "The model was replaced while this request was served; retry"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+@app.after_request
+def add_model_version(response):
+    response.headers["X-Model-Version"] = str(served_model().version)
+    return response
 
 @app.route("/", methods=["GET"])
 def serve_frontend():
@@ -32,74 +714,237 @@ def get_info():
     return jsonify({
         "min_date": MIN_DATE.strftime("%Y-%m-%d"),
         "max_date": MAX_DATE.strftime("%Y-%m-%d"),
-        "categories": VALID_CATEGORIES
+        "max_forecast_date": MAX_FORECAST_DATE.strftime("%Y-%m-%d"),
+        "categories": VALID_CATEGORIES,
+        "model_version": served_model().version,
     })
 
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """Serving metrics for this worker process"""
+    return jsonify({
+        "pid": os.getpid(),
+        "forecast_mode": FORECAST_MODE,
+        "model": dict(REGISTRY.metrics(), version=served_model().version),
+        "category_models": served_model().forest.metrics() if MODEL_LAYOUT == "per_category" else None,
+        "microbatch": served_model().microbatcher.metrics() if served_model().microbatcher is not None else None,
+        "forecast_cache": FORECAST_CACHE.metrics() if FORECAST_CACHE is not None else None,
+        "history": {
+            "max_date": MAX_DATE.strftime("%Y-%m-%d"),
+            "daily_csv_offset": DAILY_CSV_OFFSET,
+            "daily_csv_replaced": DAILY_CSV_REPLACED,
+        },
+    })
+
+@app.route("/api/ingest", methods=["POST"])
+def ingest():
+    """
+    Append new daily actuals without a restart.
+    Body: {"rows": [{"date", "product_category", "quantity", "price"}, ...]}
+    with Authorization: Bearer <INGEST_TOKEN>. Each row must be dated after its
+    category's last actual day, by today and at most INGEST_MAX_GAP_DAYS
+    after MAX_DATE. Rows are appended to daily.csv, which the
+    other workers pick up on their next request.
+    """
+    if not INGEST_TOKEN:
+        return jsonify({"error": "Ingest is disabled"}), 404
+    if not bearer_ok(INGEST_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    try:
+        rows = parse_actuals(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with HISTORY_LOCK, open(DAILY_PATH, "r+b") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if not _daily_csv_unchanged(os.fstat(f.fileno())):
+            return jsonify({"error": DAILY_CSV_REPLACED}), 503
+        # catch up with other workers first, so the check below sees their rows
+        pending = _read_appended(f)
+        if pending:
+            apply_actuals(pending)
+        latest = MAX_DATE + pd.Timedelta(days=INGEST_MAX_GAP_DAYS)
+        for product, date, _, _ in rows:
+            last = LAST_ACTUAL_DATES[product]
+            if date <= last:
+                return jsonify({
+                    "error": f"{product} already has actuals through {last.strftime('%Y-%m-%d')}"
+                }), 409
+            if date > latest:
+                return jsonify({
+                    "error": f"Rows can be dated at most {INGEST_MAX_GAP_DAYS} days after "
+                             f"{MAX_DATE.strftime('%Y-%m-%d')}; got {date.strftime('%Y-%m-%d')}"
+                }), 400
+        _append_csv(f, rows)
+        invalidated = apply_actuals(rows)
+
+    return jsonify({
+        "rows": len(rows),
+        "max_date": MAX_DATE.strftime("%Y-%m-%d"),
+        "max_forecast_date": MAX_FORECAST_DATE.strftime("%Y-%m-%d"),
+        "invalidated": invalidated,
+    })
+
+@app.route("/api/admin/reload", methods=["POST"])
+def reload_model():
+    """
+    Reload the model and feature list in this worker now (Authorization:
+    Bearer <ADMIN_TOKEN>). Other workers reload when they see the files change.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled"}), 404
+    if not bearer_ok(ADMIN_TOKEN):
+        return jsonify({"error": "Unauthorized"}), 401
+    reloaded = REGISTRY.reload()
+    g.served = REGISTRY.current
+    return jsonify({
+        "reloaded": reloaded,
+        "model_version": g.served.version,
+        "error": REGISTRY.last_error,
+    }), 200 if reloaded else 500
+
 @app.route("/predict", methods=["POST"])
 def predict():
     data = request.get_json()
     if not data:
         return jsonify({"error": "No JSON data provided"}), 400
 
-    product = data.get("product_category")
-    date = data.get("date")
-    n_days = int(data.get("n_days", 1)) if data.get("n_days") is not None else 1
-
-    if not product:
-        return jsonify({"error": "Missing product_category"}), 400
-    if not date:
-        return jsonify({"error": "Missing date"}), 400
-    if n_days <= 0 or n_days > 365:
-        return jsonify({"error": "n_days must be between 1 and 365"}), 400
+    try:
+        product, start_date, n_days = validate_query(data)
+        levels = parse_intervals(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if product not in VALID_CATEGORIES:
-        return jsonify({
-            "error": f"Invalid category '{product}'. Valid: {', '.join(VALID_CATEGORIES)}"
-        }), 400
+    mimetype = stream_mimetype()
+    if mimetype:
+        fields = ["product_category", "date", "predicted_quantity", "error"]
+        entries = [(0, (product, start_date, n_days))]
+        return Response(stream_forecasts(served_model(), entries, mimetype, fields, levels), mimetype=mimetype)
 
     try:
-        start_date = pd.to_datetime(date)
+        [pred_qtys] = forecast_queries(served_model(), [(product, start_date, n_days)], levels)
+        return jsonify(forecast_response(served_model(), product, start_date, n_days, pred_qtys, levels))
+    except RunRemovedError:
+        raise
     except Exception as e:
-        return jsonify({"error": f"Invalid date format: {str(e)}"}), 400
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
 
-    end_date = start_date + pd.Timedelta(days=n_days - 1)
-    if not (MIN_DATE <= start_date <= MAX_DATE) or not (MIN_DATE <= end_date <= MAX_DATE):
-        return jsonify({
-            "error": f"Date range out of valid bounds. Valid: {MIN_DATE.strftime('%Y-%m-%d')} to {MAX_DATE.strftime('%Y-%m-%d')}"
-        }), 400
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """
+    Forecast many {product_category, date, n_days} items in one call.
+    Body: {"items": [...]} or a bare list. Every valid item is predicted in a
+    single pass; results line up with items, invalid ones carry an "error".
+    {"items": [...], "intervals": [...]} adds those quantiles to every item.
+    With Accept: application/x-ndjson or text/csv, rows are streamed instead.
+    """
+    data = request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of items"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"At most {MAX_BATCH_ITEMS} items per batch"}), 400
+    try:
+        levels = parse_intervals(data) if isinstance(data, dict) else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # each distinct date is parsed on its own, as /predict parses it: one
+    # to_datetime over the batch would infer a single format from the first
+    # item and read every other one with it. "YYYY-MM-DD" means the same
+    # either way, so those take one vectorized call; anything this misses is
+    # parsed again per item for its error message
+    dates = [item.get("date") if isinstance(item, dict) else None for item in items]
+    distinct = list({date for date in dates if isinstance(date, str)})
+    iso = pd.to_datetime(pd.Series(distinct, dtype=object), format="%Y-%m-%d", errors="coerce")
+    parsed_dates = {}
+    for date, start_date in zip(distinct, iso.tolist()):
+        if pd.isna(start_date):
+            try:
+                start_date = pd.to_datetime(date)
+            except Exception:
+                continue
+        parsed_dates[date] = start_date
+    parsed = [parsed_dates.get(date) if isinstance(date, str) else None for date in dates]
+
+    # validated (product, start_date, n_days) tuple or error message per item
+    entries = []
+    for i, (item, start_date) in enumerate(zip(items, parsed)):
+        if not isinstance(item, dict):
+            entries.append((i, "Item must be a JSON object"))
+            continue
+        try:
+            entries.append((i, validate_query(item, start_date)))
+        except ValueError as e:
+            entries.append((i, str(e)))
+        except Exception as e:
+            entries.append((i, f"Invalid item: {str(e)}"))
+
+    mimetype = stream_mimetype()
+    if mimetype:
+        fields = ["item", "product_category", "date", "predicted_quantity", "error"]
+        return Response(stream_forecasts(served_model(), entries, mimetype, fields, levels), mimetype=mimetype)
+
+    results = [{"error": query} for _, query in entries]
+    valid = [(i, query) for i, query in entries if isinstance(query, tuple)]
+    if valid:
+        try:
+            preds = forecast_queries(served_model(), [query for _, query in valid], levels)
+        except RunRemovedError:
+            raise
+        except Exception as e:
+            return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+        for (i, query), pred_qtys in zip(valid, preds):
+            results[i] = forecast_response(served_model(), *query, pred_qtys, levels)
+
+    return jsonify({"results": results})
 
-    # Build feature rows for each date
-    rows = []
+@app.route("/predict/simulate", methods=["POST"])
+def predict_simulate():
+    """
+    Distribution of total demand over the n_days after the history, from
+    Monte Carlo sample paths (simulate.py).
+    Body: {"product_category": a category or a list (default: all), "n_days": 30,
+           "n_paths": 1000, "intervals": [0.1, 0.5, 0.9], "seed": optional int}
+    Each category gets the mean and quantiles of its cumulative demand through
+    every day; the last day's are those of the n_days total.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No JSON data provided"}), 400
     try:
-        for offset in range(n_days):
-            d = (start_date + pd.Timedelta(days=offset)).strftime("%Y-%m-%d")
-            feats = build_features(daily, product, d)
-            rows.append(feats)
+        products, n_days, n_paths, seed = validate_simulation(data)
+        levels = parse_intervals(data) or list(QUANTILES)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
-    except Exception as e:
-        return jsonify({"error": f"Feature building failed: {str(e)}"}), 500
 
+    served = served_model()
+    if isinstance(served.forest, CategoryForests):
+        forests = [served.forest.forest(product) for product in products]
+    else:
+        forests = [served.forest] * len(products)
     try:
-        X = pd.DataFrame(rows)[FEATURES]
-        pred_log = model.predict(X)  # array length == n_days
-        pred_qtys = np.expm1(pred_log)  # inverse of log1p
-        preds_out = []
-        for i in range(n_days):
-            dt = (start_date + pd.Timedelta(days=i)).strftime("%Y-%m-%d")
-            preds_out.append({
-                "date": dt,
-                "predicted_quantity": round(float(pred_qtys[i]), 2)
-            })
+        first_days, paths = simulate_demand(HISTORY, products, n_days, forests, served.features,
+                                            n_paths, seed, SIMULATION_THREADS or None)
+    except Exception as e:
+        return jsonify({"error": f"Simulation failed: {str(e)}"}), 500
+    means = np.cumsum(paths.mean(axis=1), axis=1)
+    quantiles = cumulative_quantiles(paths, levels)
 
-        return jsonify({
+    labels = quantile_labels(levels)
+    results = []
+    for product, first, mean, rows in zip(products, first_days.tolist(), means.tolist(), quantiles.tolist()):
+        dates = pd.date_range(EPOCH + pd.Timedelta(days=first), periods=n_days, freq="D").strftime("%Y-%m-%d")
+        results.append({
             "product_category": product,
-            "start_date": start_date.strftime("%Y-%m-%d"),
-            "n_days": n_days,
-            "predictions": preds_out
+            "start_date": dates[0],
+            "cumulative": [
+                {"date": dt, "mean": round(m, 2), "quantiles": {label: round(q, 2) for label, q in zip(labels, row)}}
+                for dt, m, row in zip(dates, mean, rows)
+            ],
         })
-    except Exception as e:
-        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+    return jsonify({"model_version": served.version, "n_days": n_days, "n_paths": n_paths, "results": results})
 
 """
 @app.route("/predict", methods=["POST"])
@@ -0,0 +1,188 @@
+"""
+Rolling-origin backtest of the forecast model.
+
+retail.ipynb scores the model on one chronological holdout. Here an origin
+walks across the history every --step days; at each origin the model is fit
+on the days before it and forecasts days 1..--horizon of every category the
+way /predict forecasts past the end of the history (recursive.py: each
+prediction is fed back in as that day's quantity). Forecasts are compared
+with the actuals and MAE, RMSE and WAPE are reported by horizon and by
+category:
+
+    python backtest.py                       # weekly origins over the last year, 28-day horizon
+    python backtest.py --refit-every 4       # refit every 4th origin, reuse the fit in between
+    python backtest.py --refit-every 0       # score the deployed model as is
+
+The training features are computed once for the whole history and every
+fold slices the rows before its origin (features of a day only look at the
+days before it), so folds only pay for fitting and forecasting. Folds run
+in parallel, one worker process per CPU. The deployed model was trained on
+most of the history, so --refit-every 0 overstates its accuracy.
+
+A fold's training rows come from build_training_frame and its forecast
+rows from recursive_forecast, both with the training lag convention
+(feature_builder.TRAINING_LAG_OFFSET: Quantity_lag_n is n days back).
+Refits leave out LEAKY_FEATURES: the notebook's ratio_to_cat_28d divides
+the target day's own quantity, which a forecast does not know and
+recursive_forecast replaces with the 28-day mean, so a model fit on it
+learns the target from it. The deployed model still gets it.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from feature_builder import HistoryIndex, daily_grid
+from forest import FOREST_PATH, CompiledForest, load_forest
+from history_store import DAILY_PATH
+from recursive import recursive_forecast
+from train import FEATURE_COLS, MODEL_PATH, TARGET_COL, build_training_frame, fit_model
+
+HORIZON_DAYS = 28
+STEP_DAYS = 7
+BACKTEST_DAYS = 365
+# days of history the first origin leaves for training
+MIN_TRAIN_DAYS = 90
+# built from the target day's quantity, unknown when forecasting; refits go without
+LEAKY_FEATURES = ("ratio_to_cat_28d",)
+REFIT_FEATURES = [name for name in FEATURE_COLS if name not in LEAKY_FEATURES]
+
+# set in each worker process by _init_worker
+_fold_data = {}
+
+
+def _init_worker(history, X, y, row_days, fixed_forest, n_jobs):
+    _fold_data.update(history=history, X=X, y=y, row_days=row_days,
+                      fixed_forest=fixed_forest, n_jobs=n_jobs)
+
+def _forecast(forest, features, history, origin, horizon):
+    """Forecast rows (origin, category, horizon, day, actual, forecast) for one origin."""
+    known = history.before(origin)
+    categories = list(known.categories)
+    predict_fn = lambda X: np.expm1(forest.predict(X))
+    _, _, preds = recursive_forecast(known, categories, horizon, predict_fn, features)
+    rows = []
+    for product, forecast in zip(categories, preds):
+        hist = history[product]
+        first = origin - hist.days[0]
+        # NaN past the end of the history
+        actual = np.full(horizon, np.nan)
+        known_actual = hist.quantity[first:first + horizon]
+        actual[:len(known_actual)] = known_actual
+        rows.append(pd.DataFrame({
+            "origin": origin,
+            "category": product,
+            "horizon": np.arange(1, horizon + 1),
+            "day": origin + np.arange(horizon),
+            "actual": actual,
+            "forecast": forecast,
+        }))
+    return rows
+
+def run_fold(origins, horizon):
+    """
+    Forecast from each origin (day numbers) in turn. The model is fit on the
+    rows before the first origin (REFIT_FEATURES), or is the deployed one
+    when no fit is wanted.
+    """
+    data = _fold_data
+    forest, features = data["fixed_forest"], FEATURE_COLS
+    if forest is None:
+        train = data["row_days"] < origins[0]
+        model = fit_model(data["X"][train], data["y"][train], n_jobs=data["n_jobs"])
+        forest, features = CompiledForest.from_sklearn(model), REFIT_FEATURES
+    rows = []
+    for origin in origins:
+        rows.extend(_forecast(forest, features, data["history"], origin, horizon))
+    return pd.concat(rows, ignore_index=True)
+
+def backtest(daily, origins, horizon=HORIZON_DAYS, refit_every=1, workers=None, forest=None):
+    """
+    Forecast rows for every origin (day numbers, ascending) over gap-filled daily rows.
+    refit_every: fit a model at every n-th origin and reuse it for the origins up to
+                 the next fit; 0 uses forest for all of them
+    workers: processes to run folds in (default: one per CPU, at most one per fold)
+    """
+    history = HistoryIndex.from_frame(daily, normalized=True)
+    if refit_every:
+        frame = build_training_frame(daily)
+        X = frame[REFIT_FEATURES].to_numpy(dtype=float)
+        y = frame[TARGET_COL].to_numpy(dtype=float)
+        row_days = frame["Date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+        if not (row_days < origins[0]).any():
+            raise ValueError("No training rows before the first origin")
+        folds = [origins[i:i + refit_every] for i in range(0, len(origins), refit_every)]
+    else:
+        X = y = row_days = None
+        folds = [[origin] for origin in origins]
+
+    workers = min(workers or os.cpu_count() or 1, len(folds))
+    # one fit per process: parallel folds each fit on a single core
+    initargs = (history, X, y, row_days, None if refit_every else forest, 1 if workers > 1 else -1)
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as pool:
+            results = list(pool.map(run_fold, folds, [horizon] * len(folds)))
+    else:
+        _init_worker(*initargs)
+        results = [run_fold(fold, horizon) for fold in folds]
+    results = pd.concat(results, ignore_index=True).dropna(subset=["actual"])
+    for col in ("origin", "day"):
+        results[col] = pd.to_datetime(results[col].to_numpy().astype("datetime64[D]"))
+    return results
+
+def score(results, by):
+    """MAE, RMSE and WAPE (sum of absolute errors over sum of actuals) of forecast rows grouped by by."""
+    errors = results.assign(
+        abs_err=(results["forecast"] - results["actual"]).abs(),
+        sq_err=(results["forecast"] - results["actual"]) ** 2,
+    ).groupby(by)
+    return pd.DataFrame({
+        "mae": errors["abs_err"].mean(),
+        "rmse": np.sqrt(errors["sq_err"].mean()),
+        "wape": errors["abs_err"].sum() / errors["actual"].sum(),
+        "n": errors.size(),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--daily", default=DAILY_PATH)
+    parser.add_argument("--horizon", type=int, default=HORIZON_DAYS, help="days forecast from each origin")
+    parser.add_argument("--step", type=int, default=STEP_DAYS, help="days between origins")
+    parser.add_argument("--start", default=None,
+                        help=f"first origin (default: {BACKTEST_DAYS} days before the end, "
+                             f"but at least {MIN_TRAIN_DAYS} days after the start)")
+    parser.add_argument("--refit-every", type=int, default=1, help="origins per fit; 0 scores the deployed model")
+    parser.add_argument("--workers", type=int, default=None, help="parallel processes (default: CPU count)")
+    parser.add_argument("--out", default=None, help="CSV to write every forecast row to")
+    args = parser.parse_args()
+
+    daily = daily_grid(pd.read_csv(args.daily, parse_dates=["Date"]))
+    end = daily["Date"].max()
+    if args.start:
+        start = pd.Timestamp(args.start)
+    else:
+        start = max(end - pd.Timedelta(days=BACKTEST_DAYS), daily["Date"].min() + pd.Timedelta(days=MIN_TRAIN_DAYS))
+    last_origin = end - pd.Timedelta(days=args.horizon - 1)
+    if start > last_origin:
+        parser.error(f"--start must leave {args.horizon} days before {end.date()}")
+    origins = pd.date_range(start, last_origin, freq=f"{args.step}D")
+    origins = origins.to_numpy().astype("datetime64[D]").astype(np.int64)
+
+    forest = None if args.refit_every else load_forest(MODEL_PATH, FOREST_PATH)
+    results = backtest(daily, origins, args.horizon, args.refit_every, args.workers, forest)
+    print(f"{len(origins)} origins from {start.date()}, horizon {args.horizon} days\n")
+    if not results["forecast"].any():
+        print("warning: every forecast is 0, so these scores say nothing about the model; "
+              "check it does not depend on LEAKY_FEATURES\n")
+    with pd.option_context("display.float_format", "{:.3f}".format, "display.max_rows", None):
+        print(score(results, "horizon"), end="\n\n")
+        print(score(results, "category"), end="\n\n")
+        print(score(results.assign(all="all"), "all"))
+    if args.out:
+        results.to_csv(args.out, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Per-category forests, loaded on first use.
+
+`python train.py --per-category` fits one smaller forest per Product
+Category and exports each as a compiled forest (forest.py) in a fresh run
+directory under models/categories/, then points manifest.json at it:
+
+    models/categories/manifest.json
+    models/categories/<run>/<n>/{feature,threshold,...}.npy, meta.json
+
+CategoryForests serves them. A category's arrays are read the first time
+one of its rows is predicted, and once the loaded arrays exceed a byte
+budget the least recently used categories are dropped again, so resident
+memory follows the categories that get traffic rather than the size of the
+catalog. Runs are never modified after the manifest points at them, so a
+worker still serving the previous manifest keeps loading consistent models
+until it reloads. Training removes runs older than that one: a worker that
+sat idle through two trainings finds its run gone on its next lazy load and
+gets RunRemovedError, its cue to reload.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from forest import CompiledForest, file_sha256
+
+CATEGORY_MODELS_PATH = "./models/categories"
+MANIFEST = "manifest.json"
+
+
+class RunRemovedError(FileNotFoundError):
+    """A category's forest is missing because the manifest moved on and its run was removed."""
+
+
+def save_category_forests(path, forests, features, scores=None):
+    """
+    Export {category: CompiledForest} as a new run in directory path and
+    switch manifest.json over to it. scores: optional {category: test RMSE}.
+    Runs older than the one it replaces are removed.
+    """
+    os.makedirs(path, exist_ok=True)
+    run = f"run-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    entries = []
+    for i, (category, forest) in enumerate(forests.items()):
+        forest.save(os.path.join(path, run, str(i)))
+        entries.append({
+            "category": category,
+            "dir": f"{run}/{i}",
+            "n_trees": forest.n_trees,
+            "nodes": len(forest.value),
+            "test_rmse": None if scores is None else scores.get(category),
+        })
+    target = os.path.join(path, MANIFEST)
+    previous = None
+    if os.path.exists(target):
+        with open(target) as f:
+            previous = json.load(f)["run"]
+    # manifest last: until it is replaced, loaders see the previous run
+    with open(target + ".tmp", "w") as f:
+        json.dump({"run": run, "features": list(features), "categories": entries}, f, indent=2)
+    os.replace(target + ".tmp", target)
+
+    # the previous run stays for workers that haven't reloaded yet
+    for old in os.listdir(path):
+        if old.startswith("run-") and old not in (run, previous):
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    return run
+
+
+class CategoryForests:
+    """
+    Compiled forests of one manifest, one per category, loaded lazily.
+    categories: category names in the order of the codes passed to predict
+    budget_bytes: loaded node arrays above this evict the least recently used
+                  categories (the one being predicted always stays)
+    """
+    def __init__(self, path, categories, budget_bytes):
+        manifest_path = os.path.join(path, MANIFEST)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        dirs = {entry["category"]: entry["dir"] for entry in manifest["categories"]}
+        missing = [c for c in categories if c not in dirs]
+        if missing:
+            raise ValueError(f"{manifest_path} has no model for: {', '.join(missing)}")
+        self.path = path
+        self.categories = list(categories)
+        self.dirs = dirs
+        self.feature_names = manifest["features"]
+        # identifies this set of models, like CompiledForest.source_sha256
+        self.source_sha256 = file_sha256(manifest_path)
+        self.budget_bytes = budget_bytes
+        self._loaded = OrderedDict()
+        self._loaded_bytes = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def forest(self, category):
+        """The category's CompiledForest, read from disk if it isn't loaded."""
+        with self._lock:
+            forest = self._loaded.get(category)
+            if forest is not None:
+                self._loaded.move_to_end(category)
+                return forest
+            # read into memory (not mapped), so the budget is what stays resident
+            run_dir = os.path.join(self.path, self.dirs[category])
+            try:
+                forest = CompiledForest.load(run_dir, mmap_mode=None)
+            except FileNotFoundError as e:
+                if self._manifest_replaced():
+                    raise RunRemovedError(f"{run_dir} was removed after {MANIFEST} moved to a newer run") from e
+                raise
+            self._loaded[category] = forest
+            self._loaded_bytes += forest.nbytes
+            self.loads += 1
+            while self._loaded_bytes > self.budget_bytes and len(self._loaded) > 1:
+                _, evicted = self._loaded.popitem(last=False)
+                self._loaded_bytes -= evicted.nbytes
+                self.evictions += 1
+            return forest
+
+    def _manifest_replaced(self):
+        try:
+            return file_sha256(os.path.join(self.path, MANIFEST)) != self.source_sha256
+        except OSError:
+            return True
+
+    def predict(self, X, codes):
+        """Log-scale predictions for feature rows; codes[i] indexes categories for row i."""
+        X = np.asarray(X)
+        codes = np.asarray(codes)
+        out = np.empty(len(X))
+        for code in np.unique(codes):
+            rows = codes == code
+            out[rows] = self.forest(self.categories[code]).predict(X[rows])
+        return out
+
+    def predict_quantiles(self, X, codes, levels, transform=None):
+        """predict plus per-tree quantiles, as CompiledForest.predict_quantiles."""
+        X = np.asarray(X)
+        codes = np.asarray(codes)
+        out = np.empty(len(X))
+        quantiles = np.empty((len(X), len(levels)))
+        for code in np.unique(codes):
+            rows = codes == code
+            out[rows], quantiles[rows] = self.forest(self.categories[code]).predict_quantiles(
+                X[rows], levels, transform)
+        return out, quantiles
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "categories": len(self.categories),
+                "loaded": len(self._loaded),
+                "loaded_bytes": self._loaded_bytes,
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
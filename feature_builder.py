@@ -1,9 +1,27 @@
+from collections import namedtuple
+from copy import deepcopy
+
 import pandas as pd
 import numpy as np
 
 # configurable: how many historical days to require
 HISTORY_DAYS = 60
 
+# rolling windows and EWM smoothing of the Quantity features
+ROLL_WINDOWS = (7, 14, 28)
+EWM_ALPHA = 0.3
+# lookback of "price pct change 7d"
+PRICE_LAG = 7
+# days of the Quantity_lag_<n> features
+LAGS = (1, 7, 28)
+# Quantity_lag_n reads the value n - lag_offset days before the target day.
+# Serving's rows for days in the history keep build_features' convention,
+# which counts the target day itself as lag 1; the notebook (and so every
+# model, and the forecasts past the history, where the target day is unknown)
+# uses n days back
+SERVING_LAG_OFFSET = 1
+TRAINING_LAG_OFFSET = 0
+
 def ensure_daily_index(df):
     """Ensure df has continuous daily Date index for its range."""
     df = df.sort_values("Date").set_index("Date")
@@ -20,29 +38,45 @@ def ensure_daily_index(df):
     df.index.name = "Date"
     return df.reset_index()
 
-def build_features(history_df, product, target_date):
+def daily_grid(history_df):
     """
-    history_df: full daily.csv (Date parsed as datetime, contains Product Category, Quantity, Price per Unit)
-    product: product category string
-    target_date: pd.Timestamp or parseable date string (the day you want prediction for)
-    Returns: dict of features in the exact names used by your model/features.txt
+    Canonical gap-filled history: one row per (Product Category, day) over the
+    full date range, sorted by category then Date. This is the same reindex
+    retail.ipynb does with MultiIndex.from_product; missing days get
+    Quantity 0 and the category's nearest known price. Build it once at load
+    and pass normalized=True so feature builders skip ensure_daily_index.
     """
-    # parse target_date
-    if not isinstance(target_date, pd.Timestamp):
-        target_date = pd.to_datetime(target_date)
+    all_dates = pd.date_range(history_df["Date"].min(), history_df["Date"].max(), freq="D")
+    cats = history_df["Product Category"].unique()
+    grid = pd.MultiIndex.from_product([cats, all_dates], names=["Product Category", "Date"])
+    df = (history_df
+          .set_index(["Product Category", "Date"])
+          .reindex(grid)
+          .reset_index()[list(history_df.columns)])
+    df["Quantity"] = df["Quantity"].fillna(0)
+    df["Price per Unit"] = df.groupby("Product Category", sort=False)["Price per Unit"].ffill()
+    df["Price per Unit"] = df.groupby("Product Category", sort=False)["Price per Unit"].bfill().fillna(0)
+    if "Total Amount" in df.columns:
+        df["Total Amount"] = df["Total Amount"].fillna(0)
+    return df
 
+def _product_history(history_df, product, end_date, normalized=False):
+    """Filter one product's history, gap-fill it and zero-extend it up to end_date."""
     # filter product history
     prod_hist = history_df[history_df["Product Category"] == product].copy()
     if prod_hist.empty:
         raise ValueError(f"No history for product '{product}'")
 
-    # ensure continuous daily index for range covering target_date and last HISTORY_DAYS
-    prod_hist = ensure_daily_index(prod_hist)
-    # if target_date is after last history date, allow prediction using last available history
+    # ensure continuous daily index for range covering end_date and last HISTORY_DAYS
+    if normalized:
+        prod_hist = prod_hist.reset_index(drop=True)
+    else:
+        prod_hist = ensure_daily_index(prod_hist)
+    # if end_date is after last history date, allow prediction using last available history
     last_date = prod_hist["Date"].max()
-    if target_date > last_date:
-        # extend index to target_date with Quantity=0 days (or keep last price)
-        extra_idx = pd.date_range(last_date + pd.Timedelta(days=1), target_date, freq="D")
+    if end_date > last_date:
+        # extend index to end_date with Quantity=0 days (or keep last price)
+        extra_idx = pd.date_range(last_date + pd.Timedelta(days=1), end_date, freq="D")
         if len(extra_idx) > 0:
             tail = pd.DataFrame({
                 "Date": extra_idx,
@@ -52,6 +86,27 @@ def build_features(history_df, product, target_date):
                 "Total Amount": 0
             })
             prod_hist = pd.concat([prod_hist, tail], ignore_index=True)
+    return prod_hist
+
+def build_features(history_df, product, target_date, normalized=False):
+    """
+    history_df: full daily.csv (Date parsed as datetime, contains Product Category, Quantity, Price per Unit)
+                or a HistoryIndex built from it
+    product: product category string
+    target_date: pd.Timestamp or parseable date string (the day you want prediction for)
+    normalized: history_df is already sorted and gap-filled (see daily_grid),
+                so ensure_daily_index is skipped
+    Returns: dict of features in the exact names used by your model/features.txt
+    """
+    # parse target_date
+    if not isinstance(target_date, pd.Timestamp):
+        target_date = pd.to_datetime(target_date)
+
+    if isinstance(history_df, HistoryIndex):
+        feats = _features_from_history(history_df[product], np.array([_day_number(target_date)]))
+        return {k: v[0].item() for k, v in feats.items()}
+
+    prod_hist = _product_history(history_df, product, target_date, normalized)
 
     # pick recent window for feature computation
     window_end_idx = prod_hist[prod_hist["Date"] <= target_date].index.max()
@@ -123,3 +178,381 @@ def build_features(history_df, product, target_date):
             feats[k] = 0.0
 
     return feats
+
+def _nan_to_zero(values):
+    """Replace NaN with 0.0 (inf is left alone, like build_features does)."""
+    return np.where(np.isnan(values), 0.0, values)
+
+def _day_numbers(dates):
+    """Whole days since 1970-01-01 for each date (time of day is dropped)."""
+    return pd.DatetimeIndex(dates).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+def _day_number(date):
+    """Whole days since 1970-01-01 for a single pd.Timestamp."""
+    return int(date.to_datetime64().astype("datetime64[D]").astype(np.int64))
+
+# one category's gap-filled history: day numbers, Quantity and Price per Unit
+CategoryHistory = namedtuple("CategoryHistory", ["days", "quantity", "price"])
+
+def _category_history(prod_hist):
+    """Columnar arrays for one product's continuous daily history."""
+    return CategoryHistory(
+        days=_day_numbers(prod_hist["Date"]),
+        quantity=prod_hist["Quantity"].to_numpy(dtype=float),
+        price=prod_hist["Price per Unit"].to_numpy(dtype=float),
+    )
+
+class HistoryIndex:
+    """
+    Per-category columnar view of the daily history, built once.
+    Each Product Category maps to contiguous, gap-filled numpy arrays, so the
+    HISTORY_DAYS window for a date is found by arithmetic on day numbers
+    instead of filtering and copying the whole frame on every call.
+    Can be passed to build_features / build_features_range in place of the
+    history DataFrame.
+    """
+    def __init__(self, categories):
+        self.categories = categories
+
+    @classmethod
+    def from_frame(cls, history_df, normalized=False):
+        """normalized: history_df is a daily_grid, so per-category gap filling is skipped"""
+        return cls({
+            product: _category_history(prod_hist if normalized else ensure_daily_index(prod_hist))
+            for product, prod_hist in history_df.groupby("Product Category", sort=False)
+        })
+
+    def __contains__(self, product):
+        return product in self.categories
+
+    def __getitem__(self, product):
+        hist = self.categories.get(product)
+        if hist is None:
+            raise ValueError(f"No history for product '{product}'")
+        return hist
+
+    def before(self, day):
+        """
+        The history up to (not including) day number day, as views of these
+        arrays; categories whose history starts on or after day are left out.
+        """
+        categories = {}
+        for product, hist in self.categories.items():
+            k = int(np.searchsorted(hist.days, day))
+            if k:
+                categories[product] = CategoryHistory(hist.days[:k], hist.quantity[:k], hist.price[:k])
+        return HistoryIndex(categories)
+
+    def record(self, product, dates, quantity, price, last_date=None):
+        """
+        Write actual Quantity / Price per Unit for dates after the product's
+        last actual day, extending its history through last_date (or the last
+        of dates) the way daily_grid fills gaps: Quantity 0 and the most
+        recent price carried forward. dates must be sorted. The arrays are
+        replaced, not modified, so readers holding the old CategoryHistory
+        are unaffected.
+        """
+        hist = self[product]
+        days = _day_numbers(dates)
+        last_day = max([hist.days[-1], *days[-1:]] + ([_day_number(last_date)] if last_date is not None else []))
+        n_new = last_day - hist.days[-1]
+        quantity_col = np.concatenate([hist.quantity, np.zeros(n_new)])
+        price_col = np.concatenate([hist.price, np.full(n_new, hist.price[-1])])
+        for day, q, p in zip(days, quantity, price):
+            pos = day - hist.days[0]
+            quantity_col[pos] = q
+            # later days are gap-filled until the next actual, so they take this price
+            price_col[pos:] = p
+        self.categories[product] = CategoryHistory(
+            days=np.arange(hist.days[0], last_day + 1),
+            quantity=quantity_col,
+            price=price_col,
+        )
+
+def calendar_features(days):
+    """Calendar columns for an array of day numbers, computed in numpy."""
+    dates = days.astype("datetime64[D]")
+    months = dates.astype("datetime64[M]")
+    dayofweek = (days + 3) % 7  # 1970-01-01 was a Thursday
+    # ISO week: the week of the year holding this week's Thursday
+    thursday = days - dayofweek + 3
+    iso_year_start = (thursday.astype("datetime64[D]").astype("datetime64[Y]")
+                      .astype("datetime64[D]").astype(np.int64))
+    return {
+        "day": (dates - months).astype(np.int64) + 1,
+        "month": months.astype(np.int64) % 12 + 1,
+        "dayofweek": dayofweek,
+        "is_weekend": (dayofweek >= 5).astype(np.int64),
+        "week_of_year": (thursday - iso_year_start) // 7 + 1,
+    }
+
+def prior_windows(values, positions, first=0):
+    """
+    The HISTORY_DAYS values before each position of values, oldest first:
+    array (len(positions), HISTORY_DAYS), NaN where a window reaches before
+    first (the start of that position's series; an array for stacked series).
+    """
+    padded = np.concatenate([np.full(HISTORY_DAYS, np.nan), values])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, HISTORY_DAYS)[positions]
+    if np.all(np.asarray(first) == 0):
+        return windows
+    index = positions[:, None] - HISTORY_DAYS + np.arange(HISTORY_DAYS)
+    return np.where(index >= np.reshape(first, (-1, 1)), windows, np.nan)
+
+def window_stats(prior, rolls=ROLL_WINDOWS, alpha=EWM_ALPHA):
+    """
+    Quantity_roll_mean_n / Quantity_roll_std_n over the last n values of each
+    prior window (pandas rolling with min_periods=1, ddof=1; NaN without
+    enough values) and Quantity_ewm_<alpha> over the whole window (adjusted
+    EWM, newest value weighted 1). The one implementation of these features
+    shared by serving and train.py.
+    """
+    valid = ~np.isnan(prior)
+    # windows without missing values (most rows) skip the masking
+    full = bool(valid.all())
+    prior_zeroed = prior if full else np.where(valid, prior, 0.0)
+    width = prior.shape[1]
+    stats = {}
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for n in rolls:
+            if full:
+                mean = prior[:, -n:].sum(axis=1) / n
+                var = ((prior[:, -n:] - mean[:, None]) ** 2).sum(axis=1) / (n - 1)
+            else:
+                count = valid[:, -n:].sum(axis=1)
+                mean = prior_zeroed[:, -n:].sum(axis=1) / np.where(count > 0, count, np.nan)
+                dev = np.where(valid[:, -n:], prior[:, -n:] - mean[:, None], 0.0)
+                var = (dev ** 2).sum(axis=1) / np.where(count > 1, count - 1, np.nan)
+            stats[f"Quantity_roll_mean_{n}"] = mean
+            stats[f"Quantity_roll_std_{n}"] = np.sqrt(var)
+        weights = (1 - alpha) ** np.arange(width - 1, -1, -1)
+        num = (prior_zeroed * weights).sum(axis=1)
+        den = weights.sum() if full else (valid * weights).sum(axis=1)
+        stats[f"Quantity_ewm_{alpha}"] = num / np.where(den > 0, den, np.nan)
+    return stats
+
+def lag_features(values, positions, first=0, lags=LAGS, offset=TRAINING_LAG_OFFSET):
+    """
+    Quantity_lag_<n> for the rows at positions of values: the value n - offset
+    rows back, NaN unless n rows of the row's series (which starts at row
+    first, a scalar or one per position) precede it. The one implementation
+    of the lag features shared by serving and train.py; RollingState follows
+    the same rule.
+    """
+    return {
+        f"Quantity_lag_{n}": np.where(positions - n >= first,
+                                      values[np.maximum(positions - n + offset, 0)], np.nan)
+        for n in lags
+    }
+
+def _features_from_history(hist, target_days):
+    """
+    Feature columns (dict of arrays) for each target day number, computed
+    from one category's CategoryHistory the same way build_features does.
+    """
+    # row of each target date, history rows are one per day
+    pos = target_days - hist.days[0]
+    if (pos < 0).any():
+        raise ValueError("target_date is earlier than available history")
+    window_len = np.minimum(pos, HISTORY_DAYS) + 1
+
+    # only HISTORY_DAYS rows before the earliest target are ever looked at
+    lo = max(int(pos.min()) - HISTORY_DAYS, 0)
+    hi = int(pos.max()) + 1
+    qty = hist.quantity[lo:hi]
+    price = hist.price[lo:hi]
+    if hi - lo > len(qty):
+        # target dates after the last history date: Quantity=0, keep last price
+        pad = hi - lo - len(qty)
+        last_price = hist.price[-1] if len(hist.price) else 0.0
+        qty = np.concatenate([qty, np.zeros(pad)])
+        price = np.concatenate([price, np.full(pad, last_price)])
+    pos = pos - lo
+
+    # build_features looks at the last HISTORY_DAYS + 1 rows: the target row
+    # plus up to HISTORY_DAYS prior rows (NaN where history runs out)
+    stats = window_stats(prior_windows(qty, pos))
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        price_change = np.where(
+            window_len > PRICE_LAG, price[pos] / price[np.maximum(pos - PRICE_LAG, 0)] - 1, 0.0
+        )
+
+    cat_mean_28d = stats["Quantity_roll_mean_28"]
+    feats = {
+        # the history starts at row -lo of the sliced arrays
+        **lag_features(qty, pos, -lo, offset=SERVING_LAG_OFFSET),
+        **stats,
+        "price pct change 7d": price_change,
+        "ratio_to_cat_28d": qty[pos] / (cat_mean_28d + 1e-6),
+    }
+    feats = {k: _nan_to_zero(v) for k, v in feats.items()}
+
+    # calendar features for each target date
+    feats.update(calendar_features(target_days))
+    return feats
+
+class RollingState:
+    """
+    Incremental feature state at the end of one or more series (one row per
+    category): ring buffers of the last HISTORY_DAYS quantities and PRICE_LAG
+    prices, running sum / sum of squares and count per ROLL_WINDOWS window and
+    the EWM truncated to HISTORY_DAYS values. push() appends a day in O(1) and
+    features() emits the row build_features would give the next day, with the
+    same min_periods=1 / ddof=1 semantics.
+    """
+    def __init__(self, quantities, prices, n_seen):
+        # quantities: (B, HISTORY_DAYS) most recent last, NaN where history is shorter
+        # prices: (B, PRICE_LAG) most recent last
+        # n_seen: (B,) days of history before the next target day
+        self.ring = np.array(quantities, dtype=float)
+        self.prices = np.array(prices, dtype=float)
+        self.head = 0          # ring slot of the oldest value
+        self.price_head = 0
+        self.n_seen = np.array(n_seen, dtype=np.int64)
+        valid = ~np.isnan(self.ring)
+        zeroed = np.where(valid, self.ring, 0.0)
+        self.sums = {n: zeroed[:, -n:].sum(axis=1) for n in ROLL_WINDOWS}
+        self.sumsq = {n: (zeroed[:, -n:] ** 2).sum(axis=1) for n in ROLL_WINDOWS}
+        self.counts = {n: valid[:, -n:].sum(axis=1) for n in ROLL_WINDOWS}
+        weights = (1 - EWM_ALPHA) ** np.arange(HISTORY_DAYS - 1, -1, -1)
+        self.ewm_num = (zeroed * weights).sum(axis=1)
+        self.ewm_den = (valid * weights).sum(axis=1)
+
+    @classmethod
+    def from_history(cls, hists):
+        """State after the last day of each CategoryHistory in hists."""
+        def tail(values, n):
+            values = values[-n:]
+            return np.concatenate([np.full(n - len(values), np.nan), values])
+        return cls(
+            quantities=np.stack([tail(hist.quantity, HISTORY_DAYS) for hist in hists]),
+            prices=np.stack([tail(hist.price, PRICE_LAG) for hist in hists]),
+            n_seen=[len(hist.days) for hist in hists],
+        )
+
+    def copy(self):
+        """Independent copy, e.g. to forecast ahead without moving this state."""
+        return deepcopy(self)
+
+    def repeat(self, n):
+        """State with every series repeated n times in a row, e.g. one row per sample path."""
+        out = self.copy()
+        for name in ("ring", "prices", "n_seen", "ewm_num", "ewm_den"):
+            setattr(out, name, np.repeat(getattr(self, name), n, axis=0))
+        for name in ("sums", "sumsq", "counts"):
+            setattr(out, name, {w: np.repeat(v, n, axis=0) for w, v in getattr(self, name).items()})
+        return out
+
+    def back(self, k):
+        """Quantity k days before the next target day (k=1 is the newest)."""
+        return self.ring[:, (self.head - k) % HISTORY_DAYS]
+
+    def mean(self, n):
+        """Mean quantity over the last n days, n in ROLL_WINDOWS (NaN before any day)."""
+        count = self.counts[n]
+        return self.sums[n] / np.where(count > 0, count, np.nan)
+
+    def features(self, target_qty, target_price, target_days, lag_offset=SERVING_LAG_OFFSET):
+        """
+        Feature columns (dict of arrays) for the next day of every series.
+        target_qty / target_price: that day's own Quantity and Price per Unit
+        (target_qty is only read by ratio_to_cat_28d and, with
+        SERVING_LAG_OFFSET, Quantity_lag_1)
+        target_days: its day number (see calendar_features)
+        lag_offset: SERVING_LAG_OFFSET or TRAINING_LAG_OFFSET
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means, stds = {}, {}
+            for n in ROLL_WINDOWS:
+                count = self.counts[n]
+                means[n] = self.mean(n)
+                var = (self.sumsq[n] - self.sums[n] * means[n]) / np.where(count > 1, count - 1, np.nan)
+                # running sums can leave a tiny negative variance for constant windows
+                stds[n] = np.sqrt(np.maximum(var, 0.0))
+            ewm = self.ewm_num / np.where(self.ewm_den > 0, self.ewm_den, np.nan)
+            price_change = np.where(self.n_seen >= PRICE_LAG,
+                                    target_price / self.prices[:, self.price_head] - 1, 0.0)
+            ratio = target_qty / (means[28] + 1e-6)
+
+        def lag(n):
+            # lag_features' rule on the ring buffer
+            back = n - lag_offset
+            value = target_qty if back == 0 else self.back(back)
+            return np.where(self.n_seen >= n, value, 0.0)
+
+        feats = {
+            **{f"Quantity_lag_{n}": lag(n) for n in LAGS},
+            "Quantity_roll_mean_7": means[7],
+            "Quantity_roll_mean_14": means[14],
+            "Quantity_roll_mean_28": means[28],
+            "Quantity_roll_std_7": stds[7],
+            "Quantity_roll_std_14": stds[14],
+            "Quantity_roll_std_28": stds[28],
+            "Quantity_ewm_0.3": ewm,
+            "price pct change 7d": price_change,
+            "ratio_to_cat_28d": ratio,
+        }
+        feats = {k: _nan_to_zero(v) for k, v in feats.items()}
+        feats.update(calendar_features(np.asarray(target_days)))
+        return feats
+
+    def push(self, qty, price):
+        """Append one day (Quantity and Price per Unit per series) to every window."""
+        for n in ROLL_WINDOWS:
+            leaving = self.back(n)
+            gone = ~np.isnan(leaving)
+            leaving = np.where(gone, leaving, 0.0)
+            self.sums[n] += qty - leaving
+            self.sumsq[n] += qty ** 2 - leaving ** 2
+            self.counts[n] += 1 - gone
+        decay = (1 - EWM_ALPHA) ** HISTORY_DAYS
+        oldest = self.ring[:, self.head]
+        gone = ~np.isnan(oldest)
+        self.ewm_num = (1 - EWM_ALPHA) * self.ewm_num + qty - decay * np.where(gone, oldest, 0.0)
+        self.ewm_den = (1 - EWM_ALPHA) * self.ewm_den + 1.0 - decay * gone
+        self.ring[:, self.head] = qty
+        self.head = (self.head + 1) % HISTORY_DAYS
+        self.prices[:, self.price_head] = price
+        self.price_head = (self.price_head + 1) % PRICE_LAG
+        self.n_seen += 1
+
+def build_features_range(history_df, product, start, n_days, features=None, normalized=False):
+    """
+    Vectorized equivalent of calling build_features once per day for
+    start .. start + n_days - 1. The product history is looked up (or
+    filtered and gap-filled) once, then every feature column is computed for
+    the whole window in a single numpy pass.
+    history_df: daily history DataFrame or a HistoryIndex built from it
+    features: optional column order (e.g. the contents of features.txt)
+    normalized: history_df is already sorted and gap-filled (see daily_grid)
+    Returns: DataFrame with one row per day, same values as build_features
+    """
+    if not isinstance(start, pd.Timestamp):
+        start = pd.to_datetime(start)
+    target_days = _day_number(start) + np.arange(n_days)
+
+    if isinstance(history_df, HistoryIndex):
+        hist = history_df[product]
+    else:
+        prod_hist = history_df[history_df["Product Category"] == product]
+        if prod_hist.empty:
+            raise ValueError(f"No history for product '{product}'")
+        hist = _category_history(prod_hist if normalized else ensure_daily_index(prod_hist))
+
+    X = pd.DataFrame(_features_from_history(hist, target_days))
+    return X[features] if features is not None else X
+
+def build_feature_tensor(history_df, categories, start, end, features=None):
+    """
+    Precompute every feature row build_features can produce for the given
+    categories between start and end (inclusive).
+    Returns: float array of shape (n_categories, n_days, n_features), where
+    tensor[c, d] is the row for categories[c] on start + d days
+    """
+    start = pd.Timestamp(start)
+    n_days = (pd.Timestamp(end) - start).days + 1
+    return np.stack([
+        build_features_range(history_df, product, start, n_days, features).to_numpy(dtype=float)
+        for product in categories
+    ])
@@ -0,0 +1,313 @@
+"""
+Bounded LRU cache of per-day forecasts.
+
+Entries are keyed by (model version, category, "YYYY-MM-DD" date), one per
+category-day, so overlapping windows share work: once 2023-03-10 + 7 days is
+computed, a request for 2023-03-01 + 30 days only predicts the other 23.
+
+ForecastCache lives in one process. With several gunicorn workers,
+TieredForecastCache puts it in front of a SharedForecastStore (SQLite in WAL
+mode on local disk) that every worker on the host reads and writes.
+"""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ForecastCache:
+    """
+    Thread-safe LRU mapping (model_version, category, date) -> predicted quantity.
+    max_entries: capacity; the least recently used entry is evicted beyond it
+    """
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys):
+        """Cached values for keys as a float array, NaN where missing."""
+        out = np.full(len(keys), np.nan)
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    out[i] = value
+            hits = int(np.count_nonzero(~np.isnan(out)))
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return out
+
+    def put_many(self, keys, values):
+        with self._lock:
+            for key, value in zip(keys, values):
+                self._entries[key] = float(value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, model_version=None, category=None, first_date=None, last_date=None):
+        """
+        Drop matching entries (all of them when called without arguments).
+        Any of model_version / category / the inclusive "YYYY-MM-DD" date
+        range can narrow it.
+        Returns the number of entries dropped.
+        """
+        with self._lock:
+            if model_version is None and category is None and first_date is None and last_date is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [
+                    key for key in self._entries
+                    if (model_version is None or key[0] == model_version)
+                    and (category is None or key[1] == category)
+                    and (first_date is None or key[2] >= first_date)
+                    and (last_date is None or key[2] <= last_date)
+                ]
+                for key in stale:
+                    del self._entries[key]
+                dropped = len(stale)
+            self.invalidations += dropped
+            return dropped
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class SharedForecastStore:
+    """
+    Per-day forecasts in a local SQLite database (WAL mode), shared by every
+    worker process on the host. Same keys and interface as ForecastCache.
+    Each process/thread opens its own connection; concurrent writers are
+    serialized by SQLite and wait up to timeout seconds for the lock.
+    fingerprint: identifies the data the forecasts are computed from (e.g.
+                 materialize.data_fingerprint); the file outlives restarts, so
+                 opening it with a different one drops every stored forecast
+    """
+    # keys per SELECT, below SQLite's bound-parameter limit
+    CHUNK = 500
+
+    def __init__(self, path, timeout=5.0, fingerprint=None):
+        self.path = path
+        self.timeout = timeout
+        self.fingerprint = fingerprint
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # rows dropped on open because they came from other data
+        self.dropped = 0
+        # a connection of its own, closed here: with preload_app this runs in
+        # the gunicorn master, and SQLite connections must not cross a fork
+        conn = self._open()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS forecasts ("
+                    " model_version TEXT NOT NULL, category TEXT NOT NULL, date TEXT NOT NULL,"
+                    " quantity REAL NOT NULL, PRIMARY KEY (model_version, category, date)"
+                    ") WITHOUT ROWID"
+                )
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                if fingerprint is not None:
+                    row = conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+                    if row is None or row[0] != fingerprint:
+                        self.dropped = conn.execute("DELETE FROM forecasts").rowcount
+                        conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        finally:
+            conn.close()
+        # anything the master did use later (e.g. sync_history at import) is
+        # closed in the master before forking, never in the children
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(before=self._close)
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connect(self):
+        # connections can't cross threads or a fork, so keep one per (pid, thread)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._open()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_many(self, keys):
+        """Stored values for keys as a float array, NaN where missing."""
+        out = np.full(len(keys), np.nan)
+        if not keys:
+            return out
+        # group by (model_version, category) so each query is one IN list
+        groups = {}
+        for i, (version, category, date) in enumerate(keys):
+            groups.setdefault((version, category), {})[date] = i
+        try:
+            conn = self._connect()
+            for (version, category), dates in groups.items():
+                names = list(dates)
+                for start in range(0, len(names), self.CHUNK):
+                    chunk = names[start:start + self.CHUNK]
+                    rows = conn.execute(
+                        "SELECT date, quantity FROM forecasts WHERE model_version = ? AND category = ?"
+                        f" AND date IN ({','.join('?' * len(chunk))})",
+                        [version, category, *chunk],
+                    )
+                    for date, quantity in rows:
+                        out[dates[date]] = quantity
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+        hits = int(np.count_nonzero(~np.isnan(out)))
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return out
+
+    def put_many(self, keys, values):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?)",
+                    [(*key, float(value)) for key, value in zip(keys, values)],
+                )
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+
+    def items(self, model_version, limit):
+        """Up to limit stored (key, value) pairs for one model version."""
+        rows = self._connect().execute(
+            "SELECT category, date, quantity FROM forecasts WHERE model_version = ? LIMIT ?",
+            (model_version, limit),
+        )
+        return [((model_version, category, date), quantity) for category, date, quantity in rows]
+
+    def invalidate(self, model_version=None, category=None, first_date=None, last_date=None):
+        """
+        Delete matching rows, same filters as ForecastCache.invalidate.
+        A failed delete (e.g. the database stayed locked) counts in errors
+        and returns 0, so the caller's own update still completes.
+        """
+        clauses, params = [], []
+        for column, op, value in (("model_version", "=", model_version), ("category", "=", category),
+                                  ("date", ">=", first_date), ("date", "<=", last_date)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                return conn.execute(f"DELETE FROM forecasts{where}", params).rowcount
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return 0
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            out = {
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "errors": self.errors,
+                "dropped_on_open": self.dropped,
+            }
+        try:
+            out["entries"] = self._connect().execute("SELECT COUNT(*) FROM forecasts").fetchone()[0]
+        except sqlite3.Error:
+            pass
+        return out
+
+
+class TieredForecastCache:
+    """
+    In-process ForecastCache in front of a SharedForecastStore. Lookups try
+    the LRU first and the shared store for the rest, copying what they find
+    into the LRU; writes go to both. On first use in a process the LRU is
+    warmed from the shared store, so new workers start with what the others
+    already computed.
+    """
+    def __init__(self, local, shared, model_version):
+        self.local = local
+        self.shared = shared
+        self.model_version = model_version
+        self._warmed_pid = None
+
+    def _warm(self):
+        if self._warmed_pid == os.getpid():
+            return
+        self._warmed_pid = os.getpid()
+        try:
+            items = self.shared.items(self.model_version, self.local.max_entries)
+        except sqlite3.Error:
+            return
+        if items:
+            keys, values = zip(*items)
+            self.local.put_many(keys, values)
+
+    def __len__(self):
+        return len(self.local)
+
+    def get_many(self, keys):
+        self._warm()
+        out = self.local.get_many(keys)
+        missing = np.flatnonzero(np.isnan(out))
+        if len(missing):
+            missing_keys = [keys[i] for i in missing]
+            found = self.shared.get_many(missing_keys)
+            out[missing] = found
+            hit = ~np.isnan(found)
+            if hit.any():
+                self.local.put_many([k for k, h in zip(missing_keys, hit) if h], found[hit])
+        return out
+
+    def put_many(self, keys, values):
+        self.local.put_many(keys, values)
+        self.shared.put_many(keys, values)
+
+    def invalidate(self, **filters):
+        self.shared.invalidate(**filters)
+        return self.local.invalidate(**filters)
+
+    def metrics(self):
+        return dict(self.local.metrics(), shared=self.shared.metrics())
@@ -0,0 +1,213 @@
+"""
+Array-compiled inference for the RandomForestRegressor.
+
+sklearn's predict pays for input validation, joblib dispatch and a Python
+call per tree, which dominates for the handful of rows /predict sends. Here
+the forest is flattened into contiguous arrays (one row per node across all
+trees) and every tree is walked at once, one level per step.
+
+The arrays can be exported next to the pickle and memory-mapped back, so
+serving never has to import scikit-learn or unpickle the estimator:
+
+    python forest.py    # models/rf_demand_forecast.pkl -> models/forest/
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+FOREST_PATH = "./models/forest"
+
+# arrays saved as <name>.npy in the export directory
+ARRAYS = ("feature", "threshold", "children", "missing_left", "value", "roots")
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CompiledForest:
+    """
+    Flattened forest: node i of the ensemble tests feature[i] <= threshold[i]
+    and moves to children[2 * i] (left) or children[2 * i + 1] (right).
+    Leaves point back at themselves, so max_depth synchronous steps from
+    roots land every (row, tree) on a leaf, whose prediction is value[i].
+    """
+    def __init__(self, feature, threshold, children, missing_left, value, roots,
+                 max_depth, feature_names=None, source_sha256=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.feature_names = feature_names
+        # hash of the pickle this forest was compiled from
+        self.source_sha256 = source_sha256
+        # only pay for NaN routing if some node sends missing values left
+        self.has_missing = bool(np.any(missing_left))
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the node arrays."""
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    @classmethod
+    def from_sklearn(cls, model, source_sha256=None):
+        """Flatten a fitted sklearn RandomForestRegressor (or any tree ensemble with estimators_)."""
+        features, thresholds, children, missing, values, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for est in model.estimators_:
+            tree = est.tree_
+            n = tree.node_count
+            ids = np.arange(n)
+            is_leaf = tree.children_left == -1
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            left = np.where(is_leaf, ids, tree.children_left) + offset
+            right = np.where(is_leaf, ids, tree.children_right) + offset
+            children.append(np.stack([left, right], axis=1).ravel())
+            go_left = getattr(tree, "missing_go_to_left", np.zeros(n, dtype=np.uint8))
+            missing.append(np.asarray(go_left).astype(bool))
+            values.append(tree.value[:, 0, 0])
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+        names = getattr(model, "feature_names_in_", None)
+        return cls(
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            children=np.concatenate(children).astype(np.int32),
+            missing_left=np.concatenate(missing),
+            value=np.concatenate(values).astype(np.float64),
+            roots=np.array(roots, dtype=np.int32),
+            max_depth=max_depth,
+            feature_names=None if names is None else [str(n) for n in names],
+            source_sha256=source_sha256,
+        )
+
+    def save(self, path):
+        """
+        Write the arrays as .npy files plus meta.json into directory path.
+        Each file is written aside and renamed into place, so processes that
+        have the previous export memory-mapped keep reading the old files.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAYS:
+            target = os.path.join(path, f"{name}.npy")
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, np.ascontiguousarray(getattr(self, name)))
+            os.replace(target + ".tmp", target)
+        # meta.json last: it is what loaders and the model watcher look at
+        target = os.path.join(path, "meta.json")
+        with open(target + ".tmp", "w") as f:
+            json.dump({
+                "max_depth": self.max_depth,
+                "feature_names": self.feature_names,
+                "source_sha256": self.source_sha256,
+            }, f, indent=2)
+        os.replace(target + ".tmp", target)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Load a forest written by save, memory-mapped read-only by default."""
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ARRAYS}
+        return cls(**arrays, **meta)
+
+    def _descend(self, X, node):
+        """Leaves reached by walking row i of X down from each start node in node[i]: (n_rows, k)."""
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        n_rows, n_features = X.shape
+        X = X.ravel()
+        # flat offset of each row's first feature, one column per tree
+        row_start = (np.arange(n_rows) * n_features)[:, None]
+        for _ in range(self.max_depth):
+            x = X.take(row_start + self.feature.take(node))
+            go_left = x <= self.threshold.take(node)
+            if self.has_missing:
+                nan = np.isnan(x)
+                go_left[nan] = self.missing_left.take(node[nan])
+            node = self.children.take(2 * node + ~go_left)
+        return node
+
+    def apply(self, X):
+        """Leaf node of every tree for every row: int array (n_rows, n_trees)."""
+        return self._descend(X, np.repeat(self.roots[None, :], len(X), axis=0))
+
+    def predict_trees(self, X):
+        """Every tree's prediction for every row: array (n_rows, n_trees)."""
+        return self.value.take(self.apply(X))
+
+    def predict(self, X):
+        """Forest prediction (mean over trees), same as model.predict."""
+        return self.predict_trees(X).mean(axis=1)
+
+    def predict_sampled(self, X, trees):
+        """
+        Prediction of tree trees[i] (an index below n_trees) for row i: array
+        (n_rows,). Only that tree is walked, so it costs one tree, not n_trees.
+        """
+        roots = self.roots.take(np.asarray(trees))[:, None]
+        return self.value.take(self._descend(X, roots)[:, 0])
+
+    def predict_quantiles(self, X, levels, transform=None):
+        """
+        Forest prediction and quantiles of the per-tree predictions, from one
+        traversal. transform (e.g. np.expm1 for a log target) maps the tree
+        predictions before the quantiles are taken; it must be increasing.
+        Returns (mean as predict gives it, array (n_rows, len(levels))), the
+        quantiles interpolated like np.quantile's default.
+        """
+        trees = self.predict_trees(X)
+        mean = trees.mean(axis=1)
+        position = np.asarray(levels, dtype=float) * (self.n_trees - 1)
+        lo = np.floor(position).astype(np.intp)
+        hi = np.minimum(lo + 1, self.n_trees - 1)
+        # sorted untransformed: transform keeps the order, so it only runs on
+        # the 2 * len(levels) order statistics needed, not on every tree.
+        # (a full sort of a few hundred columns beats a multi-kth np.partition)
+        trees = np.sort(trees, axis=1)
+        below, above = trees[:, lo], trees[:, hi]
+        if transform is not None:
+            below, above = transform(below), transform(above)
+        return mean, below + (above - below) * (position - lo)
+
+
+def load_forest(model_path, forest_path=FOREST_PATH):
+    """
+    Compiled forest for model_path. Uses the export in forest_path when it was
+    built from the same pickle (or the pickle isn't deployed), so sklearn is
+    never imported; otherwise unpickles the model and compiles it in memory.
+    """
+    source_sha256 = file_sha256(model_path) if os.path.exists(model_path) else None
+    if os.path.exists(os.path.join(forest_path, "meta.json")):
+        forest = CompiledForest.load(forest_path)
+        if source_sha256 is None or forest.source_sha256 == source_sha256:
+            return forest
+
+    import joblib
+    return CompiledForest.from_sklearn(joblib.load(model_path), source_sha256)
+
+
+if __name__ == "__main__":
+    import joblib
+
+    model_path = "./models/rf_demand_forecast.pkl"
+    forest = CompiledForest.from_sklearn(joblib.load(model_path), file_sha256(model_path))
+    forest.save(FOREST_PATH)
+    print(f"Exported {forest.n_trees} trees ({len(forest.value)} nodes) to {FOREST_PATH}")
@@ -0,0 +1,24 @@
+"""
+Gunicorn settings (used by the Procfile).
+
+With preload_app the model, history and precomputed tables are loaded once in
+the master and inherited by every worker through fork, so workers share one
+physical copy instead of each loading their own. The forest itself is
+memory-mapped from models/forest/, which the page cache shares either way.
+Set PRELOAD_APP=0 to go back to loading the app separately in each worker.
+"""
+import gc
+import os
+
+preload_app = os.environ.get("PRELOAD_APP", "1") == "1"
+
+# GUNICORN_THREADS > 1 runs threaded (gthread) workers, which lets concurrent
+# requests share model calls when MICROBATCH_WINDOW_MS is set
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+
+def pre_fork(server, worker):
+    # Move everything loaded so far out of the GC's reach: a collection in a
+    # worker would otherwise write to every object header it scans and turn
+    # the shared copy-on-write pages into private copies.
+    gc.collect()
+    gc.freeze()
@@ -0,0 +1,138 @@
+"""
+Binary columnar store of the gap-filled daily history.
+
+Parsing daily.csv (dates included) dominates startup once the history gets
+deep. This module converts it once into one directory per category holding
+int32 day offsets and float64 Quantity / Price per Unit as .npy files, which
+workers memory-map instead:
+
+    python history_store.py    # data/daily.csv -> data/history/
+
+meta.json records the sha256 and length of the CSV the store was built from.
+A store is used only while daily.csv still starts with those bytes; rows
+appended after them (e.g. by /api/ingest) are applied on top at startup, and
+anything else falls back to parsing the CSV.
+"""
+import hashlib
+import io
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from feature_builder import CategoryHistory, HistoryIndex, daily_grid
+
+HISTORY_STORE_PATH = "./data/history"
+DAILY_PATH = "./data/daily.csv"
+
+# arrays saved as <category dir>/<name>.npy
+ARRAYS = ("days", "quantity", "price")
+
+# history: HistoryIndex; columns: daily.csv header; last_actual_dates:
+# category -> pd.Timestamp of its last actual row; csv_offset: bytes of
+# daily.csv the history reflects
+LoadedHistory = namedtuple("LoadedHistory", ["history", "columns", "last_actual_dates", "csv_offset"])
+
+
+def _prefix_sha256(path, n_bytes):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        remaining = n_bytes
+        while remaining:
+            chunk = f.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h.hexdigest()
+
+
+def _write_npy(path, array):
+    # written aside and renamed, so workers mapping the old file keep valid pages
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def read_history_csv(csv_path=DAILY_PATH):
+    """Parse daily.csv and gap-fill it (the slow path the store replaces)."""
+    with open(csv_path, "rb") as f:
+        data = f.read()
+    raw = pd.read_csv(io.BytesIO(data), parse_dates=["Date"])
+    return LoadedHistory(
+        history=HistoryIndex.from_frame(daily_grid(raw), normalized=True),
+        columns=list(raw.columns),
+        last_actual_dates=raw.groupby("Product Category")["Date"].max().to_dict(),
+        csv_offset=len(data),
+    )
+
+
+def save_history_store(path, loaded, csv_path=DAILY_PATH):
+    """Write a LoadedHistory read from csv_path as a store in directory path."""
+    os.makedirs(path, exist_ok=True)
+    history = loaded.history
+    start_day = min(int(history[product].days[0]) for product in history.categories)
+    partitions = []
+    for i, (product, hist) in enumerate(history.categories.items()):
+        partition = os.path.join(path, str(i))
+        os.makedirs(partition, exist_ok=True)
+        _write_npy(os.path.join(partition, "days.npy"), (hist.days - start_day).astype(np.int32))
+        _write_npy(os.path.join(partition, "quantity.npy"), hist.quantity.astype(np.float64))
+        _write_npy(os.path.join(partition, "price.npy"), hist.price.astype(np.float64))
+        partitions.append({
+            "category": product,
+            "dir": str(i),
+            "last_actual_date": loaded.last_actual_dates[product].strftime("%Y-%m-%d"),
+        })
+    # meta.json last: until it is replaced, loaders see the previous store
+    target = os.path.join(path, "meta.json")
+    with open(target + ".tmp", "w") as f:
+        json.dump({
+            "start_date": str(np.datetime64(start_day, "D")),
+            "columns": loaded.columns,
+            "categories": partitions,
+            "csv_bytes": loaded.csv_offset,
+            "csv_sha256": _prefix_sha256(csv_path, loaded.csv_offset),
+        }, f, indent=2)
+    os.replace(target + ".tmp", target)
+
+
+def load_history_store(path=HISTORY_STORE_PATH, csv_path=DAILY_PATH, mmap_mode="r"):
+    """
+    Memory-map a store written by save_history_store. Returns None when it is
+    missing or csv_path no longer starts with the bytes it was built from.
+    """
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path) or not os.path.exists(csv_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if (os.path.getsize(csv_path) < meta["csv_bytes"]
+            or _prefix_sha256(csv_path, meta["csv_bytes"]) != meta["csv_sha256"]):
+        return None
+
+    start_day = int(np.datetime64(meta["start_date"], "D").astype(np.int64))
+    categories = {}
+    for partition in meta["categories"]:
+        arrays = {name: np.load(os.path.join(path, partition["dir"], f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ARRAYS}
+        categories[partition["category"]] = CategoryHistory(
+            days=arrays["days"].astype(np.int64) + start_day,
+            quantity=arrays["quantity"],
+            price=arrays["price"],
+        )
+    return LoadedHistory(
+        history=HistoryIndex(categories),
+        columns=meta["columns"],
+        last_actual_dates={p["category"]: pd.Timestamp(p["last_actual_date"]) for p in meta["categories"]},
+        csv_offset=meta["csv_bytes"],
+    )
+
+
+if __name__ == "__main__":
+    loaded = read_history_csv(DAILY_PATH)
+    save_history_store(HISTORY_STORE_PATH, loaded, DAILY_PATH)
+    n_days = sum(len(hist.days) for hist in loaded.history.categories.values())
+    print(f"Wrote {len(loaded.history.categories)} categories ({n_days} category-days) to {HISTORY_STORE_PATH}")
@@ -0,0 +1,64 @@
+"""
+Materialized forecasts: every answer /predict can give, computed once.
+
+The model is deterministic and the valid (category, date) grid is small, so
+the expm1'd predictions for all of it fit in one (n_categories, n_days) array.
+app.py builds it at startup; running this module as a script writes it to
+models/forecasts.npz so workers can load it instead of predicting at boot:
+
+    python materialize.py
+"""
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from forest import file_sha256
+
+FORECASTS_PATH = "./models/forecasts.npz"
+
+def data_fingerprint(model_version, *paths):
+    """Hash of the model version and the files a forecast table was computed from."""
+    h = hashlib.sha256(str(model_version).encode())
+    for path in paths:
+        h.update(file_sha256(path).encode())
+    return h.hexdigest()
+
+def materialize_forecasts(predict_fn, feature_tensor):
+    """Run predict_fn once over every row of the feature tensor."""
+    n_cats, n_days, n_feats = feature_tensor.shape
+    return predict_fn(feature_tensor.reshape(n_cats * n_days, n_feats)).reshape(n_cats, n_days)
+
+def save_forecasts(path, table, categories, start_date, fingerprint):
+    np.savez(
+        path,
+        table=table,
+        categories=np.array(categories, dtype=str),
+        start_date=np.array(pd.Timestamp(start_date).strftime("%Y-%m-%d")),
+        fingerprint=np.array(fingerprint),
+    )
+
+def load_forecasts(path, categories, start_date, n_days, fingerprint):
+    """
+    Load a table written by save_forecasts. Returns None when the file is
+    missing or was built from a different model, history or date grid.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as f:
+        if (str(f["fingerprint"]) != fingerprint
+                or f["categories"].tolist() != list(categories)
+                or str(f["start_date"]) != pd.Timestamp(start_date).strftime("%Y-%m-%d")
+                or f["table"].shape[1] != n_days):
+            return None
+        return f["table"]
+
+if __name__ == "__main__":
+    os.environ["FORECAST_MODE"] = "materialized"
+    import app
+
+    served = app.REGISTRY.current
+    save_forecasts(FORECASTS_PATH, served.forecast_table, app.VALID_CATEGORIES,
+                   app.MIN_DATE, served.fingerprint)
+    print(f"Saved {served.forecast_table.size} forecasts to {FORECASTS_PATH}")
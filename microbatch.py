@@ -0,0 +1,189 @@
+"""
+In-process micro-batching for model predictions.
+
+Concurrent requests in a threaded worker each hand their feature rows to a
+MicroBatcher. A background thread waits up to max_wait_ms after the first
+pending request (or until max_rows rows are queued), runs the model once on
+the stacked matrix and gives every caller back its own slice.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# queueing delays kept for the percentiles in metrics()
+DELAY_SAMPLES = 2048
+
+
+class _Pending:
+    __slots__ = ("X", "codes", "enqueued", "done", "result", "error")
+
+    def __init__(self, X, codes):
+        self.X = X
+        self.codes = codes
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesces predict_fn calls from concurrent threads.
+    predict_fn: maps a (n_rows, n_features) array to n_rows predictions;
+                when callers pass category codes, they are stacked the same
+                way and passed on as predict_fn(X, codes=codes)
+    max_wait_ms: how long a batch stays open after its first request
+    max_rows: a batch is closed early once it holds this many rows; bigger
+              requests skip the queue and are predicted directly
+    """
+    def __init__(self, predict_fn, max_wait_ms=2.0, max_rows=256):
+        self.predict_fn = predict_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._closed = False
+        self._reset_metrics()
+
+    def _reset_metrics(self):
+        self._batches = 0
+        self._requests = 0
+        self._rows = 0
+        self._bypassed = 0
+        # batch sizes in rows, bucketed by powers of two: "1", "2", "3-4", "5-8", ...
+        self._size_hist = {}
+        self._delays = deque(maxlen=DELAY_SAMPLES)
+
+    def _ensure_started(self):
+        # the worker thread is started lazily and again after a fork, so a
+        # batcher created in a preloading gunicorn master works in every worker
+        if self._pid == os.getpid() or self._closed:
+            return
+        with self._lock:
+            if self._pid != os.getpid() and not self._closed:
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, name="microbatch", daemon=True).start()
+                self._pid = os.getpid()
+
+    def predict(self, X, codes=None):
+        """Predict X (rows of category codes), sharing one predict_fn call with concurrent callers."""
+        X = np.asarray(X)
+        if len(X) >= self.max_rows:
+            with self._lock:
+                self._bypassed += 1
+            return self._call(X, codes)
+        self._ensure_started()
+        pending = _Pending(X, None if codes is None else np.asarray(codes))
+        # checked and queued under the lock, so nothing lands behind close()'s sentinel
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._queue.put(pending)
+        if closed:
+            return self._call(X, codes)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def close(self):
+        """
+        Stop the worker thread once the requests already queued are answered,
+        releasing predict_fn (and the model it holds). Callers that still have
+        this batcher, e.g. requests that started before a reload, then call
+        predict_fn directly.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._pid == os.getpid():
+                self._queue.put(None)
+
+    def _run(self):
+        q = self._queue
+        closing = False
+        while not closing:
+            first = q.get()
+            if first is None:
+                return
+            batch = [first]
+            rows = len(first.X)
+            deadline = first.enqueued + self.max_wait
+            while rows < self.max_rows:
+                # whatever is already queued joins, even past the deadline:
+                # once this thread falls behind, that is where the batching is
+                try:
+                    pending = q.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    try:
+                        pending = q.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                if pending is None:
+                    # close() was called: answer this batch, then exit
+                    closing = True
+                    break
+                batch.append(pending)
+                rows += len(pending.X)
+            self._execute(batch, rows)
+
+    def _call(self, X, codes):
+        return self.predict_fn(X) if codes is None else self.predict_fn(X, codes=codes)
+
+    def _execute(self, batch, rows):
+        started = time.perf_counter()
+        try:
+            codes = None
+            if all(p.codes is not None for p in batch):
+                codes = np.concatenate([p.codes for p in batch])
+            preds = self._call(np.concatenate([p.X for p in batch]), codes)
+            splits = np.cumsum([len(p.X) for p in batch])[:-1]
+            for pending, part in zip(batch, np.split(preds, splits)):
+                pending.result = part
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+        for pending in batch:
+            pending.done.set()
+
+        bucket = 1 << max(rows - 1, 0).bit_length()
+        label = str(bucket) if bucket <= 2 else f"{bucket // 2 + 1}-{bucket}"
+        with self._lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._rows += rows
+            self._size_hist[label] = self._size_hist.get(label, 0) + 1
+            self._delays.extend(started - p.enqueued for p in batch)
+
+    def metrics(self):
+        """Batch-size distribution and queueing delay since start (this process only)."""
+        with self._lock:
+            delays = np.array(self._delays) * 1000.0
+            out = {
+                "max_wait_ms": self.max_wait * 1000.0,
+                "max_rows": self.max_rows,
+                "batches": self._batches,
+                "requests": self._requests,
+                "rows": self._rows,
+                "bypassed": self._bypassed,
+                "mean_rows_per_batch": self._rows / self._batches if self._batches else 0.0,
+                "mean_requests_per_batch": self._requests / self._batches if self._batches else 0.0,
+                "batch_rows_histogram": dict(sorted(self._size_hist.items(), key=lambda kv: int(kv[0].split("-")[-1]))),
+            }
+        if len(delays):
+            out["queue_delay_ms"] = {
+                "p50": float(np.percentile(delays, 50)),
+                "p90": float(np.percentile(delays, 90)),
+                "p99": float(np.percentile(delays, 99)),
+                "max": float(delays.max()),
+            }
+        return out
@@ -0,0 +1,54 @@
+"""
+Recursive multi-step forecasting past the end of the history.
+
+build_features pads days after the last history date with Quantity = 0, so
+lag, rolling and EWM features for far-ahead days collapse toward zero.
+recursive_forecast instead walks forward one day at a time and feeds each
+day's predicted quantity back in as that day's Quantity for the days after
+it.
+
+The target day's own quantity is unknown when its features are built, and
+serving's rows for days in the history read it twice: as Quantity_lag_1
+(SERVING_LAG_OFFSET) and in ratio_to_cat_28d, the two features the forest
+leans on most. Filled with 0 they pin every forecast near the model's
+zero-demand answer. Forecast rows therefore use the training lags
+(TRAINING_LAG_OFFSET: lag_n is n days back, as the model was fitted, so
+lag_1 is the previous day) and stand in the 28-day mean for the target
+day's quantity in ratio_to_cat_28d, i.e. a typical day. The previous day's
+quantity would do for the ratio too, but a single zero day then predicts
+zero and every later day repeats it.
+
+All categories advance together on one RollingState: every step builds one
+feature row per category in O(1) and makes one predict call.
+"""
+import numpy as np
+
+from feature_builder import TRAINING_LAG_OFFSET, RollingState
+
+
+def recursive_forecast(history, categories, n_steps, predict_fn, features, state=None):
+    """
+    Forecast n_steps days after the end of each category's history.
+    history: HistoryIndex
+    predict_fn: maps feature rows (in features order) to predicted quantities
+    features: feature column order, e.g. the contents of features.txt
+    state: RollingState at the end of the history for categories, when the
+           caller already keeps one (it is not modified)
+    Returns (first_days, X, preds): day number of each category's first
+    forecast day, the feature rows used (n_categories, n_steps, n_features)
+    and the predictions (n_categories, n_steps)
+    """
+    hists = [history[product] for product in categories]
+    first_days = np.array([hist.days[-1] + 1 for hist in hists])
+    last_prices = np.array([hist.price[-1] if len(hist.price) else 0.0 for hist in hists])
+    state = RollingState.from_history(hists) if state is None else state.copy()
+
+    X = np.empty((len(categories), n_steps, len(features)))
+    preds = np.empty((len(categories), n_steps))
+    for step in range(n_steps):
+        feats = state.features(state.mean(28), last_prices, first_days + step, TRAINING_LAG_OFFSET)
+        X[:, step] = np.column_stack([feats[name] for name in features])
+        preds[:, step] = predict_fn(X[:, step])
+        # later days see this prediction as the day's quantity; price stays at its last value
+        state.push(preds[:, step], last_prices)
+    return first_days, X, preds
@@ -0,0 +1,102 @@
+"""
+Hot reload of the served model.
+
+ModelRegistry keeps whatever the app serves for one model version (the
+forest, its feature list and everything precomputed from them) behind a
+single attribute, `current`. A reload loads and prepares the replacement off
+the request path, checks it, and then rebinds `current` in one assignment:
+requests that already took the old value finish on it, later ones get the new
+one, and a replacement that fails to load or prepare is never served.
+
+Reloads start when one of the watched files changes (poll(), cheap enough to
+call on every request) or on demand (reload()).
+"""
+import os
+import threading
+import time
+
+
+class ModelRegistry:
+    """
+    load: () -> loaded model files; the slow, lock-free part of a reload
+    prepare: loaded -> served object; raises to reject the new version
+    watch_paths: files whose modification triggers a reload from poll()
+    lock: held around prepare and the swap, so it can read state that other
+          writers (e.g. history ingestion) update under the same lock
+    on_swap: called with (old, new) after a new version went live
+    poll_seconds: minimum interval between checks of watch_paths
+    """
+    def __init__(self, load, prepare, watch_paths, lock=None, on_swap=None, poll_seconds=2.0):
+        self._load = load
+        self._prepare = prepare
+        self.watch_paths = list(watch_paths)
+        self.lock = lock if lock is not None else threading.Lock()
+        self._on_swap = on_swap
+        self.poll_seconds = poll_seconds
+        # one reload at a time
+        self._reload_lock = threading.Lock()
+        self._next_poll = 0.0
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error = None
+        self._signature = self._files_signature()
+        with self.lock:
+            self.current = prepare(load())
+        self.loaded_at = time.time()
+
+    def _files_signature(self):
+        signature = []
+        for path in self.watch_paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload(self, force=True):
+        """
+        Load, prepare and swap in the model files as they are now.
+        force: reload even if the watched files look unchanged
+        Returns True if a new version went live; on failure the old one keeps
+        serving and the error is kept in last_error.
+        """
+        with self._reload_lock:
+            signature = self._files_signature()
+            if not force and signature == self._signature:
+                return False
+            # remembered even on failure, so broken files aren't retried until they change again
+            self._signature = signature
+            try:
+                loaded = self._load()
+                with self.lock:
+                    new = self._prepare(loaded)
+                    old, self.current = self.current, new
+            except Exception as e:
+                self.failed_reloads += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                return False
+            self.reloads += 1
+            self.last_error = None
+            self.loaded_at = time.time()
+        if self._on_swap is not None:
+            self._on_swap(old, new)
+        return True
+
+    def poll(self):
+        """Start a background reload if a watched file changed since the last load."""
+        now = time.monotonic()
+        if now < self._next_poll:
+            return
+        self._next_poll = now + self.poll_seconds
+        if self._files_signature() != self._signature and not self._reload_lock.locked():
+            threading.Thread(target=self.reload, kwargs={"force": False},
+                             name="model-reload", daemon=True).start()
+
+    def metrics(self):
+        return {
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_error": self.last_error,
+        }
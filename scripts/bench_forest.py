@@ -0,0 +1,59 @@
+"""
+Benchmark CompiledForest against sklearn's model.predict.
+
+Checks that both agree to 1e-9 on real feature rows, then times each for
+batch sizes 1, 30 and 365, plus the compiled forest with the quantiles of
+"intervals" requests (LEVELS). Run from the repo root:
+
+    python -m scripts.bench_forest
+"""
+import time
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from feature_builder import HistoryIndex, build_feature_tensor, daily_grid
+from forest import CompiledForest
+
+BATCH_SIZES = (1, 30, 365)
+REPEATS = 50
+LEVELS = (0.1, 0.5, 0.9)
+
+def best_time(fn, repeats=REPEATS):
+    """Best wall time of fn() over repeats, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1e3
+
+def main():
+    warnings.filterwarnings("ignore")
+    model = joblib.load("./models/rf_demand_forecast.pkl")
+    with open("./models/features.txt") as f:
+        features = f.read().splitlines()
+    daily = daily_grid(pd.read_csv("./data/daily.csv", parse_dates=["Date"]))
+    categories = daily["Product Category"].unique().tolist()
+    history = HistoryIndex.from_frame(daily, normalized=True)
+    tensor = build_feature_tensor(history, categories, daily["Date"].min(), daily["Date"].max(), features)
+    rows = tensor.reshape(-1, len(features))
+
+    forest = CompiledForest.from_sklearn(model)
+    diff = np.abs(forest.predict(rows) - model.predict(pd.DataFrame(rows, columns=features))).max()
+    print(f"max abs diff vs sklearn over {len(rows)} rows: {diff:.3g}")
+    assert diff <= 1e-9
+
+    print(f"{'batch':>6} {'sklearn ms':>12} {'compiled ms':>12} {'speedup':>8} {'quantiles ms':>13} {'overhead':>9}")
+    for n in BATCH_SIZES:
+        X = rows[:n]
+        X_df = pd.DataFrame(X, columns=features)
+        sk = best_time(lambda: model.predict(X_df))
+        comp = best_time(lambda: forest.predict(X))
+        quant = best_time(lambda: forest.predict_quantiles(X, LEVELS, np.expm1))
+        print(f"{n:>6} {sk:>12.3f} {comp:>12.3f} {sk / comp:>7.1f}x {quant:>13.3f} {quant / comp - 1:>+9.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Measure model load time and memory: pickled sklearn forest vs compiled export,
+and the history: parsing daily.csv vs memory-mapping the data/history store.
+
+Each case runs in a fresh interpreter (numpy already imported, as in the app)
+and reports wall time, peak RSS growth and whether sklearn got imported.
+Export the forest and the history first with `python forest.py` and
+`python history_store.py`, then from the repo root:
+
+    python -m scripts.bench_startup
+"""
+import json
+import os
+import subprocess
+import sys
+
+from forest import FOREST_PATH
+
+MODEL_PATH = "./models/rf_demand_forecast.pkl"
+
+PROBE = """
+import json, resource, sys, time, warnings
+import numpy as np
+warnings.filterwarnings("ignore")
+rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+{load}
+elapsed = time.perf_counter() - t0
+rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": elapsed, "rss_mb": (rss1 - rss0) / 1024,
+                  "sklearn": "sklearn" in sys.modules}}))
+"""
+
+CASES = {
+    "joblib.load(pkl)": "import joblib; joblib.load({model!r})",
+    "CompiledForest.load(mmap)": "from forest import CompiledForest; CompiledForest.load({forest!r})",
+    "import app (pickle)": "import app",
+    "import app (compiled)": "import app",
+    "read_history_csv": "from history_store import read_history_csv; read_history_csv()",
+    "load_history_store(mmap)": "from history_store import load_history_store; assert load_history_store()",
+}
+
+def run(name, load, env):
+    code = PROBE.format(load=load.format(model=MODEL_PATH, forest=FOREST_PATH))
+    out = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    if not os.path.exists(os.path.join(FOREST_PATH, "meta.json")):
+        sys.exit(f"No export in {FOREST_PATH}, run `python forest.py` first")
+    print(f"{'case':<28} {'seconds':>8} {'peak RSS +MB':>13} {'sklearn':>8}")
+    for name, load in CASES.items():
+        env = dict(os.environ, FORECAST_MODE="live")
+        if name == "import app (pickle)":
+            env["FOREST_PATH"] = "./models/no-export"
+        r = run(name, load, env)
+        print(f"{name:<28} {r['seconds']:>8.3f} {r['rss_mb']:>13.1f} {str(r['sklearn']):>8}")
+
+if __name__ == "__main__":
+    main()
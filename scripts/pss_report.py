@@ -0,0 +1,96 @@
+"""
+Per-worker memory report for the gunicorn deployment (Linux only).
+
+PSS (proportional set size) charges each shared page to the processes that
+map it in equal parts, so summing it across workers gives the real footprint,
+unlike RSS which counts shared pages once per process.
+
+    python -m scripts.pss_report              # compare PRELOAD_APP=0 vs 1
+    python -m scripts.pss_report --pid 1234   # report a running master
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+def smaps_rollup(pid):
+    """Memory counters of one process in MB, from /proc/<pid>/smaps_rollup."""
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in FIELDS:
+                out[key] = int(rest.split()[0]) / 1024
+    return out
+
+def worker_pids(master_pid):
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+def report(master_pid, title):
+    print(f"\n{title}")
+    print(f"{'process':<16}" + "".join(f"{k:>15}" for k in FIELDS))
+    total_pss = 0.0
+    for label, pid in [("master", master_pid)] + [(f"worker {p}", p) for p in worker_pids(master_pid)]:
+        mem = smaps_rollup(pid)
+        total_pss += mem["Pss"]
+        print(f"{label:<16}" + "".join(f"{mem[k]:>15.1f}" for k in FIELDS))
+    print(f"{'total PSS':<16}{total_pss:>30.1f} MB")
+    return total_pss
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def launch_and_report(preload, workers):
+    port = free_port()
+    env = dict(os.environ, PRELOAD_APP="1" if preload else "0")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app", "-c", "gunicorn.conf.py",
+         "-w", str(workers), "-b", f"127.0.0.1:{port}"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.time() + 120
+        while True:
+            try:
+                urllib.request.urlopen(f"{url}/api/info", timeout=1).read()
+                if len(worker_pids(proc.pid)) == workers:
+                    break
+            except OSError:
+                pass
+            if time.time() > deadline or proc.poll() is not None:
+                raise RuntimeError("gunicorn did not come up")
+            time.sleep(0.5)
+        # touch every worker so lazily-used pages are resident
+        body = b'{"product_category": "Beauty", "date": "2023-03-01", "n_days": 30}'
+        for _ in range(workers * 10):
+            req = urllib.request.Request(f"{url}/predict", data=body,
+                                         headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(req, timeout=10).read()
+        return report(proc.pid, f"PRELOAD_APP={'1' if preload else '0'}, {workers} workers (MB)")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pid", type=int, help="gunicorn master pid to inspect")
+    parser.add_argument("--workers", type=int, default=3)
+    args = parser.parse_args()
+    if args.pid:
+        report(args.pid, f"gunicorn master {args.pid} (MB)")
+        return
+    before = launch_and_report(False, args.workers)
+    after = launch_and_report(True, args.workers)
+    print(f"\ntotal PSS: {before:.1f} MB -> {after:.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Monte Carlo demand paths past the end of the history.
+
+recursive.py feeds each day's mean prediction back in, which gives one path
+per category: summing its days estimates the expected total over a horizon,
+but says nothing about how far the total can stray from it. simulate_demand
+draws n_paths sample paths instead. At every step each path predicts its day
+with one tree picked at random and takes that tree's quantity as the day's
+Quantity, so its later lag, rolling and EWM features follow its own draws.
+
+The paths of a category advance together on one RollingState with a row per
+path: a step is one (n_paths, n_features) matrix through
+CompiledForest.predict_sampled, which walks only the picked tree of each
+row. Categories are simulated in parallel threads.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from feature_builder import TRAINING_LAG_OFFSET, RollingState
+
+N_PATHS = 1000
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def simulate_paths(forest, hist, n_steps, features, n_paths, rng):
+    """
+    Sampled quantities (n_paths, n_steps) for the n_steps days after the
+    last day of a CategoryHistory. Prices stay at their last value.
+    forest: CompiledForest predicting log1p(Quantity) for feature rows in features order
+    rng: numpy Generator the trees are drawn with
+    """
+    state = RollingState.from_history([hist]).repeat(n_paths)
+    prices = np.full(n_paths, hist.price[-1] if len(hist.price) else 0.0)
+    days = np.full(n_paths, hist.days[-1] + 1)
+    paths = np.empty((n_paths, n_steps))
+    for step in range(n_steps):
+        # the target day's own quantity is unknown: rows are built as in recursive_forecast
+        feats = state.features(state.mean(28), prices, days + step, TRAINING_LAG_OFFSET)
+        X = np.column_stack([feats[name] for name in features])
+        trees = rng.integers(forest.n_trees, size=n_paths)
+        paths[:, step] = np.expm1(forest.predict_sampled(X, trees))
+        state.push(paths[:, step], prices)
+    return paths
+
+def simulate_demand(history, categories, n_steps, forests, features, n_paths=N_PATHS, seed=None, workers=None):
+    """
+    Sample paths of the n_steps days after the end of each category's history.
+    history: HistoryIndex
+    forests: CompiledForest of each category (the same one for a global model)
+    seed: makes the draws reproducible; each category gets its own stream
+    workers: threads to simulate categories in (default: one per CPU)
+    Returns (first_days, paths): day number of each category's first
+    simulated day and the quantities (n_categories, n_paths, n_steps)
+    """
+    hists = [history[product] for product in categories]
+    rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(categories))]
+    run = lambda forest, hist, rng: simulate_paths(forest, hist, n_steps, features, n_paths, rng)
+    workers = min(workers or os.cpu_count() or 1, len(categories))
+    if workers > 1:
+        with ThreadPoolExecutor(workers) as pool:
+            paths = list(pool.map(run, forests, hists, rngs))
+    else:
+        paths = list(map(run, forests, hists, rngs))
+    first_days = np.array([hist.days[-1] + 1 for hist in hists])
+    return first_days, np.stack(paths)
+
+def cumulative_quantiles(paths, levels=QUANTILES):
+    """
+    Quantiles over the paths of total demand from the first simulated day
+    through each day: array (..., n_steps, len(levels)) for paths (..., n_paths, n_steps).
+    """
+    return np.moveaxis(np.quantile(np.cumsum(paths, axis=-1), levels, axis=-2), 0, -1)
@@ -0,0 +1,220 @@
+"""
+Training pipeline of retail.ipynb as a script.
+
+    python train.py                                  # train on data/daily.csv
+    python train.py --raw retail_sales_dataset.csv   # rebuild data/daily.csv from transactions first
+    python train.py --per-category                   # one smaller forest per category
+
+Writes models/rf_demand_forecast.pkl, models/features.txt and the compiled
+export in models/forest/; running workers hot-reload them. --per-category
+fits CATEGORY_RF_PARAMS forests on each category's rows in parallel worker
+processes and writes them to models/categories/ (category_models.py)
+instead of the global model.
+
+The rolling and EWM features come from feature_builder.prior_windows and
+window_stats, the functions serving uses, and are computed for all
+categories at once on a stacked array instead of per-group pandas calls.
+Two things differ from the notebook on purpose:
+- rolling windows stop at the category boundary (the notebook's
+  groupby().shift(1).rolling() reads the previous category's last days at
+  the start of each category), and the EWM only looks back HISTORY_DAYS days
+  like serving (0.7 ** 60 < 1e-9 of the weight)
+- calendar features are computed from the Date of every row; the notebook
+  took them from the transactions, leaving NaN on gap-filled days
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_squared_error
+from sklearn.model_selection import train_test_split
+
+from aggregate import DATE_FORMAT, aggregate_files, rebuild_daily
+from category_models import CATEGORY_MODELS_PATH, save_category_forests
+from feature_builder import (HISTORY_DAYS, LAGS, PRICE_LAG, ROLL_WINDOWS, calendar_features, daily_grid,
+                             lag_features, prior_windows, window_stats)
+from forest import FOREST_PATH, CompiledForest, file_sha256
+from history_store import DAILY_PATH, HISTORY_STORE_PATH
+
+MODEL_PATH = "./models/rf_demand_forecast.pkl"
+FEATURES_PATH = "./models/features.txt"
+
+FEATURE_COLS = [
+    "Quantity_lag_1", "Quantity_lag_7", "Quantity_lag_28",
+    "Quantity_roll_mean_7", "Quantity_roll_mean_14", "Quantity_roll_mean_28",
+    "Quantity_roll_std_7", "Quantity_roll_std_14", "Quantity_roll_std_28",
+    "Quantity_ewm_0.3",
+    "price pct change 7d", "ratio_to_cat_28d",
+    "day", "month", "dayofweek", "is_weekend", "week_of_year",
+]
+TARGET_COL = "log_qty"
+
+RF_PARAMS = dict(
+    n_estimators=200,
+    max_depth=10,
+    min_samples_split=5,
+    min_samples_leaf=3,
+    random_state=42,
+    n_jobs=-1,
+)
+TEST_SIZE = 0.2
+# per-category forests see one category's rows: fewer, shallower trees
+CATEGORY_RF_PARAMS = dict(RF_PARAMS, n_estimators=50, max_depth=8, n_jobs=1)
+
+# rows whose prior windows are materialized at once; small enough to stay in cache
+BLOCK_ROWS = 4096
+
+
+def _group_starts(df, grp):
+    """Row position of the first row of each row's group; groups must be contiguous."""
+    codes = df[grp].to_numpy()
+    new_group = np.ones(len(df), dtype=bool)
+    new_group[1:] = codes[1:] != codes[:-1]
+    return np.maximum.accumulate(np.where(new_group, np.arange(len(df)), 0))
+
+def _shift(values, first, n):
+    """groupby().shift(n) on stacked groups: values n rows back, NaN before the group start."""
+    positions = np.arange(len(values))
+    return np.where(positions - n >= first, values[np.maximum(positions - n, 0)], np.nan)
+
+def make_lags(df, grp, col="Quantity", lags=LAGS, rolls=ROLL_WINDOWS):
+    """
+    The notebook's lag, rolling and EWM features of col, for rows sorted by
+    grp then Date. Lags are n rows back (NaN before the group's first row);
+    rolling and EWM features cover the days before each row, with rolling
+    std 0 where it is undefined.
+    """
+    df = df.copy()
+    values = df[col].to_numpy(dtype=float)
+    first = _group_starts(df, grp)
+    positions = np.arange(len(df))
+    for name, column in lag_features(values, positions, first, lags).items():
+        df[name.replace("Quantity", col, 1)] = column
+
+    # rows more than HISTORY_DAYS into their group have full windows and take
+    # window_stats' unmasked path; the others are masked at the group start
+    full = positions - first >= HISTORY_DAYS
+    stats = {}
+    for rows, masked in ((positions[full], False), (positions[~full], True)):
+        for lo in range(0, len(rows), BLOCK_ROWS):
+            block = rows[lo:lo + BLOCK_ROWS]
+            # only the HISTORY_DAYS rows before the block are read
+            start = max(int(block[0]) - HISTORY_DAYS, 0)
+            end = int(block[-1]) + 1
+            prior = prior_windows(values[start:end], block - start, first[block] - start if masked else 0)
+            for name, column in window_stats(prior, rolls).items():
+                if name not in stats:
+                    stats[name] = np.empty(len(df))
+                stats[name][block] = column
+    for name, column in stats.items():
+        if "_roll_std_" in name:
+            column = np.where(np.isnan(column), 0.0, column)
+        df[name.replace("Quantity", col, 1)] = column
+    return df
+
+def build_training_frame(daily):
+    """Feature and target columns for the gap-filled daily rows, as the notebook builds them."""
+    daily = daily.sort_values(["Product Category", "Date"], kind="stable").reset_index(drop=True)
+    daily = make_lags(daily, grp="Product Category")
+
+    price = daily["Price per Unit"].to_numpy(dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        change = price / _shift(price, _group_starts(daily, "Product Category"), PRICE_LAG) - 1
+    daily["price pct change 7d"] = np.where(np.isnan(change), 0.0, change)
+    # the notebook's cat_mean_28d is the category's 28-day mean of prior days
+    daily["ratio_to_cat_28d"] = daily["Quantity"] / (daily["Quantity_roll_mean_28"] + 1e-6)
+    days = daily["Date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    for name, column in calendar_features(days).items():
+        daily[name] = column
+
+    daily["log_qty"] = np.log1p(daily["Quantity"])
+    return daily.dropna(subset=["Quantity_lag_1"])
+
+def fit_model(X, y, **params):
+    """The notebook's RandomForestRegressor fitted on X, y; params override RF_PARAMS."""
+    return RandomForestRegressor(**{**RF_PARAMS, **params}).fit(X, y)
+
+def _fit_and_score(X, y, params):
+    """Fit on the first 1 - TEST_SIZE of the rows, score on the rest. Returns (model, test RMSE in units)."""
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=TEST_SIZE, shuffle=False)
+    model = fit_model(X_train, y_train, **params)
+    y_pred = np.expm1(model.predict(X_test))
+    return model, np.sqrt(mean_squared_error(np.expm1(y_test), y_pred))
+
+def train(daily):
+    """Fit the notebook's forest on the gap-filled daily rows. Returns (model, test RMSE in units)."""
+    frame = build_training_frame(daily)
+    return _fit_and_score(frame[FEATURE_COLS], frame[TARGET_COL], {})
+
+def _fit_category(X, y):
+    model, rmse = _fit_and_score(X, y, CATEGORY_RF_PARAMS)
+    return CompiledForest.from_sklearn(model), rmse
+
+def train_per_category(daily, workers=None):
+    """
+    Fit one CATEGORY_RF_PARAMS forest per category, in parallel processes.
+    Returns ({category: CompiledForest}, {category: test RMSE in units}).
+    workers: processes to fit in (default: one per CPU, at most one per category)
+    """
+    frame = build_training_frame(daily)
+    groups = [(category, rows[FEATURE_COLS], rows[TARGET_COL])
+              for category, rows in frame.groupby("Product Category", sort=False)]
+    workers = min(workers or os.cpu_count() or 1, len(groups))
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            fitted = list(pool.map(_fit_category, [X for _, X, _ in groups], [y for _, _, y in groups]))
+    else:
+        fitted = [_fit_category(X, y) for _, X, y in groups]
+    categories = [category for category, _, _ in groups]
+    return ({c: forest for c, (forest, _) in zip(categories, fitted)},
+            {c: float(rmse) for c, (_, rmse) in zip(categories, fitted)})
+
+def save_model(model, model_path=MODEL_PATH, features_path=FEATURES_PATH, forest_path=FOREST_PATH):
+    """Write the pickle, the feature list and the compiled export, each renamed into place."""
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    joblib.dump(model, model_path + ".tmp")
+    os.replace(model_path + ".tmp", model_path)
+    with open(features_path + ".tmp", "w") as f:
+        f.write("\n".join(FEATURE_COLS))
+    os.replace(features_path + ".tmp", features_path)
+    if forest_path is not None:
+        CompiledForest.from_sklearn(model, file_sha256(model_path)).save(forest_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--daily", default=DAILY_PATH, help="gap-filled daily aggregate to train on")
+    parser.add_argument("--raw", nargs="+", default=None, help="raw transaction CSVs to rebuild --daily from first")
+    parser.add_argument("--date-format", default=DATE_FORMAT, help="format of the --raw files' Date column")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--features", default=FEATURES_PATH)
+    parser.add_argument("--forest", default=FOREST_PATH, help="compiled export directory")
+    parser.add_argument("--per-category", action="store_true", help="fit one forest per category instead")
+    parser.add_argument("--categories-path", default=CATEGORY_MODELS_PATH, help="per-category export directory")
+    parser.add_argument("--workers", type=int, default=None, help="parallel processes for --per-category")
+    args = parser.parse_args()
+
+    if args.raw:
+        store_path = HISTORY_STORE_PATH if os.path.abspath(args.daily) == os.path.abspath(DAILY_PATH) else None
+        n = rebuild_daily(aggregate_files(args.raw, date_format=args.date_format), args.daily, store_path)
+        print(f"Wrote {n} rows to {args.daily}")
+
+    daily = daily_grid(pd.read_csv(args.daily, parse_dates=["Date"]))
+    if args.per_category:
+        forests, scores = train_per_category(daily, args.workers)
+        for category, rmse in scores.items():
+            print(f"{category}: test RMSE {rmse}")
+        run = save_category_forests(args.categories_path, forests, FEATURE_COLS, scores)
+        print(f"Saved {len(forests)} category models to {args.categories_path}/{run}")
+        return
+    model, rmse = train(daily)
+    print("Test RMSE:", rmse)
+    save_model(model, args.model, args.features, args.forest)
+    print(f"Saved {args.model}, {args.features} and {args.forest}")
+
+if __name__ == "__main__":
+    main()
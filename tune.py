@@ -0,0 +1,190 @@
+"""
+Hyperparameter search for the forecast forest.
+
+retail.ipynb's RandomForestRegressor settings were picked by hand. This
+searches GRID with successive halving over time-ordered folds: every round
+fits all remaining candidates on the most recent part of each fold's
+training days, keeps the best 1/--factor by RMSE (plus any candidate on the
+accuracy / latency Pareto front) and gives the survivors factor times more
+rows, until the last round trains on the full windows:
+
+    python tune.py
+    python tune.py --folds 5 --factor 2 --out search.csv
+
+Next to the RMSE every candidate gets the p99 time of a /predict call (one
+feature row through the compiled forest, the default n_days=1 request), so
+a cheaper model can be picked when it is nearly as accurate. The feature
+matrix is built once, saved as .npy files and memory-mapped by the worker
+processes, which fit one candidate on one fold at a time.
+"""
+import argparse
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import TimeSeriesSplit
+
+from feature_builder import daily_grid
+from forest import CompiledForest
+from history_store import DAILY_PATH
+from train import FEATURE_COLS, RF_PARAMS, TARGET_COL, build_training_frame, fit_model
+
+GRID = {
+    "n_estimators": [50, 100, 200, 400],
+    "max_depth": [6, 10, 14, None],
+    "min_samples_leaf": [1, 3, 10],
+}
+N_FOLDS = 4
+FACTOR = 3
+# training rows per fold in the first round, at least
+MIN_ROWS = 200
+# /predict calls timed per candidate
+LATENCY_CALLS = 200
+
+# memory-mapped in each worker process by _init_worker
+_search_data = {}
+
+
+def _init_worker(cache_dir):
+    for name in ("X", "y"):
+        _search_data[name] = np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode="r")
+
+def time_folds(row_days, n_folds=N_FOLDS):
+    """
+    Expanding-window folds over rows sorted by day, split on whole days so a
+    day's categories fall on one side: (train_stop, test_stop) row bounds,
+    training on rows [0, train_stop) and testing on [train_stop, test_stop).
+    """
+    days = np.unique(row_days)
+    folds = []
+    for _, test in TimeSeriesSplit(n_folds).split(days):
+        train_stop = int(np.searchsorted(row_days, days[test[0]]))
+        test_stop = int(np.searchsorted(row_days, days[test[-1]], side="right"))
+        folds.append((train_stop, test_stop))
+    return folds
+
+def request_latencies(forest, X, calls=LATENCY_CALLS):
+    """Wall time in ms of /predict's model call on one row at a time."""
+    timings = np.empty(calls)
+    for i in range(calls):
+        row = X[i % len(X)][None, :]
+        t0 = time.perf_counter()
+        np.expm1(forest.predict(row))
+        timings[i] = time.perf_counter() - t0
+    return timings * 1e3
+
+def evaluate(params, fold, n_rows):
+    """
+    Fit params on the last n_rows training rows of fold and score the compiled
+    forest on its test rows. Returns (RMSE in units, compiled forest).
+    """
+    X, y = _search_data["X"], _search_data["y"]
+    train_stop, test_stop = fold
+    lo = max(train_stop - n_rows, 0)
+    model = fit_model(X[lo:train_stop], y[lo:train_stop], n_jobs=1, **params)
+    forest = CompiledForest.from_sklearn(model)
+    X_test = np.asarray(X[train_stop:test_stop])
+    pred = np.expm1(forest.predict(X_test))
+    rmse = np.sqrt(np.mean((pred - np.expm1(y[train_stop:test_stop])) ** 2))
+    return rmse, forest
+
+def pareto_front(rmse, latency):
+    """Mask of the points no other point beats on both RMSE and latency."""
+    front = np.zeros(len(rmse), dtype=bool)
+    best = np.inf
+    for i in np.lexsort((rmse, latency)):
+        if rmse[i] < best:
+            front[i] = True
+            best = rmse[i]
+    return front
+
+def successive_halving(candidates, folds, pool_map, factor=FACTOR, min_rows=MIN_ROWS):
+    """
+    Run the search; pool_map(fn, *iterables) runs evaluate calls (e.g. a
+    process pool's map) and the feature matrix must be loaded in this
+    process too. Returns one row per candidate and round with its params,
+    training rows per fold, mean RMSE over folds, p99 latency of the forest
+    fit on the last fold and whether it was on that round's Pareto front.
+    """
+    n_rounds = 1
+    while factor ** n_rounds < len(candidates):
+        n_rounds += 1
+    max_rows = max(train_stop for train_stop, _ in folds)
+    alive = list(range(len(candidates)))
+    rounds = []
+    for r in range(n_rounds):
+        n_rows = max(math.ceil(max_rows / factor ** (n_rounds - 1 - r)), min_rows)
+        tasks = [(i, fold) for i in alive for fold in folds]
+        outcomes = list(pool_map(evaluate, [candidates[i] for i, _ in tasks],
+                                 [fold for _, fold in tasks], [n_rows] * len(tasks)))
+        per_candidate = [outcomes[k * len(folds):(k + 1) * len(folds)] for k in range(len(alive))]
+        rmse = np.array([np.mean([fold_rmse for fold_rmse, _ in results]) for results in per_candidate])
+        # timed here, one at a time, so fits running in the pool don't skew them
+        train_stop, test_stop = folds[-1]
+        X_test = np.asarray(_search_data["X"][train_stop:test_stop])
+        p99 = np.array([np.percentile(request_latencies(results[-1][1], X_test), 99) for results in per_candidate])
+        front = pareto_front(rmse, p99)
+        rounds.append(pd.DataFrame([
+            {"round": r, "rows": n_rows, **candidates[i], "rmse": rmse[k], "p99_ms": p99[k], "pareto": front[k]}
+            for k, i in enumerate(alive)
+        ]))
+        keep = set(np.argsort(rmse, kind="stable")[:math.ceil(len(alive) / factor)]) | set(np.flatnonzero(front))
+        alive = [i for k, i in enumerate(alive) if k in keep]
+    return pd.concat(rounds, ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--daily", default=DAILY_PATH)
+    parser.add_argument("--folds", type=int, default=N_FOLDS, help="time-ordered CV folds")
+    parser.add_argument("--factor", type=int, default=FACTOR, help="candidates kept per round: 1/factor")
+    parser.add_argument("--min-rows", type=int, default=MIN_ROWS, help="training rows per fold in the first round")
+    parser.add_argument("--workers", type=int, default=None, help="parallel processes (default: CPU count)")
+    parser.add_argument("--out", default=None, help="CSV to write every round's results to")
+    args = parser.parse_args()
+
+    frame = build_training_frame(daily_grid(pd.read_csv(args.daily, parse_dates=["Date"])))
+    frame = frame.sort_values("Date", kind="stable")
+    row_days = frame["Date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+    folds = time_folds(row_days, args.folds)
+    candidates = [dict(zip(GRID, values)) for values in product(*GRID.values())]
+    workers = args.workers or os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        np.save(os.path.join(cache_dir, "X.npy"), frame[FEATURE_COLS].to_numpy(dtype=float))
+        np.save(os.path.join(cache_dir, "y.npy"), frame[TARGET_COL].to_numpy(dtype=float))
+        del frame
+        _init_worker(cache_dir)
+        if workers > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cache_dir,)) as pool:
+                results = successive_halving(candidates, folds, pool.map, args.factor, args.min_rows)
+        else:
+            results = successive_halving(candidates, folds, map, args.factor, args.min_rows)
+        _search_data.clear()
+
+    final = results[results["round"] == results["round"].max()].sort_values("rmse")
+    print(f"{len(candidates)} candidates, {args.folds} folds, {results['round'].max() + 1} rounds; "
+          f"last round on {final['rows'].iloc[0]} training rows per fold\n")
+    shown = final.drop(columns=["round", "rows"])
+    # max_depth=None turns the column into floats, which to_string prints as
+    # NaN (formatters never see missing values), so spell the values out first
+    for name in GRID:
+        shown[name] = shown[name].map(lambda v: "None" if pd.isna(v) else str(int(v)))
+    with pd.option_context("display.float_format", "{:.4f}".format, "display.width", 200):
+        print(shown.to_string(index=False))
+    notebook = {name: RF_PARAMS[name] for name in GRID}
+    matches = results[np.logical_and.reduce([results[name] == value for name, value in notebook.items()])]
+    if len(matches):
+        last = matches.iloc[-1]
+        print(f"\nnotebook settings {notebook}: rmse {last['rmse']:.4f}, p99 {last['p99_ms']:.4f} ms "
+              f"(round {last['round']}, {last['rows']} rows per fold)")
+    if args.out:
+        results.to_csv(args.out, index=False)
+
+if __name__ == "__main__":
+    main()